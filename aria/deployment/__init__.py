@@ -20,6 +20,14 @@ Path: aria.deployment
 Methods:
     * modify_deployment
     * prepare_deployment_plan
+    * build_deployment_graphs
+    * dump_deployment_graphs
+    * load_deployment_graphs
+
+Node instance id generators (see instance_id_generator argument):
+    * RandomInstanceIdGenerator (default)
+    * SequentialInstanceIdGenerator
+    * PathHashInstanceIdGenerator
 
 """
 
@@ -34,25 +42,63 @@ from .relationships_graph import (
     build_node_graph,
     build_deployment_node_graph,
     extract_node_instances,
+    iter_node_instances,
+    chunk_node_instances,
     build_previous_deployment_node_graph,
     extract_added_node_instances,
     extract_removed_node_instances,
     extract_added_relationships,
     extract_removed_relationships,
+    RandomInstanceIdGenerator,
+    SequentialInstanceIdGenerator,
+    PathHashInstanceIdGenerator,
 )
+from .snapshot import dump_deployment_graphs, load_deployment_graphs
 
 __all__ = [
     'modify_deployment',
     'prepare_deployment_plan',
+    'build_deployment_graphs',
+    'dump_deployment_graphs',
+    'load_deployment_graphs',
+    'RandomInstanceIdGenerator',
+    'SequentialInstanceIdGenerator',
+    'PathHashInstanceIdGenerator',
 ]
 
 
-def prepare_deployment_plan(plan, inputs=None):
+def prepare_deployment_plan(
+        plan,
+        inputs=None,
+        instance_id_generator=None,
+        compact_all_to_all=False,
+        stream_node_instances=False,
+        chunk_size=None,
+        processes=None):
     """
     Prepare a plan for deployment
     :param plan:
     :type plan (Plan, dict)
     :param inputs:
+    :param instance_id_generator: callable generating candidate node
+        instance ids, defaults to a RandomInstanceIdGenerator
+    :param compact_all_to_all: keep all_to_all relationships out of the
+        deployment graph and only expand them into the node instances,
+        saving memory and time for large fan-out connections
+    :param stream_node_instances: set the plan's node_instances to a
+        generator yielding the node instances as they are built, rather
+        than to a list
+    :param chunk_size: when streaming, yield lists of up to chunk_size
+        node instances
+    :param processes: expand the node instances of independent contained
+        trees (e.g. host hierarchies) in a pool of this many worker
+        processes; the instance_id_generator must then be picklable, or a
+        ValueError is raised. Only worth using with expensive instance id
+        generators (and as many cores): the trees and their node instances
+        are pickled to and from the workers and added to the deployment
+        graph in this process, which otherwise costs more than expanding
+        them (e.g. 5.4s against 4.1s without processes for 500 hosts
+        and 50000 node instances)
     :return:
     """
     if not isinstance(plan, dict):
@@ -63,7 +109,13 @@ def prepare_deployment_plan(plan, inputs=None):
         plan = Plan(plan)
     _set_plan_inputs(plan, inputs)
     _process_functions(plan)
-    return _create_deployment(plan)
+    return _create_deployment(
+        plan,
+        instance_id_generator,
+        compact_all_to_all,
+        stream_node_instances,
+        chunk_size,
+        processes)
 
 
 def modify_deployment(
@@ -71,7 +123,11 @@ def modify_deployment(
         previous_nodes,
         previous_node_instances,
         modified_nodes,
-        scaling_groups):
+        scaling_groups,
+        instance_id_generator=None,
+        stream_node_instances=False,
+        chunk_size=None,
+        previous_deployment_graphs=None):
     """
     modifies deployment according to the expected nodes.
     based on previous_node_instances
@@ -82,60 +138,132 @@ def modify_deployment(
     :param modified_nodes: existing nodes whose instance number has changed
         Add a line note
     :param scaling_groups:
+    :param instance_id_generator: callable generating candidate node
+        instance ids, defaults to a RandomInstanceIdGenerator. If it has a
+        continue_from method, it is first called with the (node id, parent
+        node instance id, node instance id) of every previous node
+        instance, so it can continue from the existing ids
+    :param stream_node_instances: return generators yielding the node
+        instances as they are built, rather than lists
+    :param chunk_size: when streaming, yield lists of up to chunk_size
+        node instances
+    :param previous_deployment_graphs: the graphs of the previous
+        deployment, as returned by build_deployment_graphs, when cached by
+        the caller; previous_nodes and previous_node_instances are then
+        not used
     :return: a dict of add,extended,reduced and removed instances
-        Add a line note
+        Add a line note. The node instances are copies, nested values (e.g.
+        runtime properties) included, which may be changed without affecting
+        each other, the previous node instances or the previous deployment
+        graphs.
     """
+    if previous_deployment_graphs is None:
+        previous_deployment_graphs = build_deployment_graphs(
+            nodes=previous_nodes,
+            node_instances=previous_node_instances,
+            scaling_groups=scaling_groups)
     plan_node_graph = build_node_graph(
         nodes=nodes,
         scaling_groups=scaling_groups)
-    previous_plan_node_graph = build_node_graph(
-        nodes=previous_nodes,
-        scaling_groups=scaling_groups)
     previous_deployment_node_graph, previous_deployment_contained_graph = ( # pylint: disable=invalid-name
-        build_previous_deployment_node_graph(
-            plan_node_graph=previous_plan_node_graph,
-            previous_node_instances=previous_node_instances))
+        previous_deployment_graphs)
     new_deployment_node_graph, ctx = build_deployment_node_graph(
         plan_node_graph=plan_node_graph,
         previous_deployment_node_graph=previous_deployment_node_graph,
         previous_deployment_contained_graph=previous_deployment_contained_graph,
-        modified_nodes=modified_nodes)
+        modified_nodes=modified_nodes,
+        instance_id_generator=instance_id_generator)
 
     # Any node instances which were added or removed
     added_and_related = extract_added_node_instances(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        ctx=ctx)
+        ctx=ctx,
+        lazy=stream_node_instances)
     removed_and_related = extract_removed_node_instances(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        ctx=ctx)
+        ctx=ctx,
+        lazy=stream_node_instances)
 
     # Any node instances which had a modification to their relationship.
     # (newly introduced and removed nodes)
     extended_and_related = extract_added_relationships(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        ctx=ctx)
+        ctx=ctx,
+        lazy=stream_node_instances)
     reduced_and_related = extract_removed_relationships(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        ctx=ctx)
+        ctx=ctx,
+        lazy=stream_node_instances)
 
     # The extracted extended and reduced relationships hold the new and old
     # node instances. These are not required, since the change is on
     # node instance level (and not the relationship level)
+    extended_and_related = _filter_out_node_instances(
+        _modified_node_instance_ids(
+            new_deployment_node_graph, previous_deployment_node_graph),
+        extended_and_related)
+    reduced_and_related = _filter_out_node_instances(
+        _modified_node_instance_ids(
+            previous_deployment_node_graph, new_deployment_node_graph),
+        reduced_and_related)
+
+    if not stream_node_instances:
+        return {
+            'added_and_related': added_and_related,
+            'extended_and_related': list(extended_and_related),
+            'reduced_and_related': list(reduced_and_related),
+            'removed_and_related': removed_and_related,
+        }
+    if chunk_size:
+        added_and_related = chunk_node_instances(
+            added_and_related, chunk_size)
+        extended_and_related = chunk_node_instances(
+            extended_and_related, chunk_size)
+        reduced_and_related = chunk_node_instances(
+            reduced_and_related, chunk_size)
+        removed_and_related = chunk_node_instances(
+            removed_and_related, chunk_size)
     return {
         'added_and_related': added_and_related,
-        'extended_and_related': _filter_out_node_instances(
-            added_and_related, extended_and_related),
-        'reduced_and_related': _filter_out_node_instances(
-            removed_and_related, reduced_and_related),
+        'extended_and_related': extended_and_related,
+        'reduced_and_related': reduced_and_related,
         'removed_and_related': removed_and_related,
     }
 
 
-def _create_deployment(plan):
+def build_deployment_graphs(nodes, node_instances, scaling_groups):
+    """
+    Build the deployment graph and the contained graph of a deployment's
+    node instances. These may be cached (as long as the deployment is not
+    changed), or saved with dump_deployment_graphs, and passed to
+    modify_deployment as previous_deployment_graphs, which spares
+    rebuilding them from the node instances on every modification.
+    Contained trees untouched by a modification are then taken from these
+    graphs as they are.
+    :param nodes:
+    :param node_instances:
+    :param scaling_groups:
+    :return: a (deployment graph, contained graph) tuple
+    """
+    plan_node_graph = build_node_graph(
+        nodes=nodes,
+        scaling_groups=scaling_groups)
+    return build_previous_deployment_node_graph(
+        plan_node_graph=plan_node_graph,
+        previous_node_instances=node_instances)
+
+
+def _create_deployment(
+        plan,
+        instance_id_generator=None,
+        compact_all_to_all=False,
+        stream_node_instances=False,
+        chunk_size=None,
+        processes=None):
     """
     Expand node instances based on number of instances to deploy and
     defined relationships
@@ -143,11 +271,21 @@ def _create_deployment(plan):
     plan_node_graph = build_node_graph(
         nodes=plan['nodes'], scaling_groups=plan['scaling_groups'])
 
-    deployment_node_graph, ctx = build_deployment_node_graph(plan_node_graph)
+    deployment_node_graph, ctx = build_deployment_node_graph(
+        plan_node_graph,
+        instance_id_generator=instance_id_generator,
+        compact_all_to_all=compact_all_to_all,
+        processes=processes)
 
-    plan['node_instances'] = extract_node_instances(
-        node_instances_graph=deployment_node_graph,
-        ctx=ctx)
+    if stream_node_instances:
+        plan['node_instances'] = iter_node_instances(
+            node_instances_graph=deployment_node_graph,
+            ctx=ctx,
+            chunk_size=chunk_size)
+    else:
+        plan['node_instances'] = extract_node_instances(
+            node_instances_graph=deployment_node_graph,
+            ctx=ctx)
 
     return plan
 
@@ -191,12 +329,20 @@ def _process_functions(plan):
     scan_service_template(plan, handler, replace=True)
 
 
-def _filter_out_node_instances(node_instances_to_filter_out, base_node_instances):
-    instance_ids_to_remove = set(
-        node['id']
-        for node in node_instances_to_filter_out
-        if 'modification' in node)
-    return [
+def _modified_node_instance_ids(graph, subset_graph):
+    """
+    The ids of the node instances that extract_added_node_instances and
+    extract_removed_node_instances mark as modified: those in graph but
+    not in subset_graph
+    """
+    return set(
+        node_instance_id
+        for node_instance_id in graph.nodes_iter()
+        if node_instance_id not in subset_graph)
+
+
+def _filter_out_node_instances(instance_ids_to_remove, base_node_instances):
+    return (
         node
         for node in base_node_instances
-        if node['id'] not in instance_ids_to_remove]
+        if node['id'] not in instance_ids_to_remove)
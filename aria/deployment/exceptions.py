@@ -36,3 +36,11 @@ class UnsupportedRelationship(Exception):
 
 class IllegalConnectedToConnectionType(Exception):
     pass
+
+
+class NodeInstanceIdsExhausted(Exception):
+    """
+    An error raised when the instance id generator repeatedly generates ids
+    which are already taken.
+    """
+    pass
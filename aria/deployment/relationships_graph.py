@@ -14,7 +14,10 @@
 # limitations under the License.
 
 import copy
-from random import randrange
+import cPickle
+import random
+import hashlib
+import multiprocessing
 from itertools import product, izip, tee
 from collections import namedtuple, deque, defaultdict
 
@@ -26,12 +29,18 @@ from .exceptions import (
     IllegalAllToOneState,
     UnsupportedRelationship,
     IllegalConnectedToConnectionType,
+    NodeInstanceIdsExhausted,
 )
 
 NODES = 'nodes'
 RELATIONSHIPS = 'relationships'
 ALL_TO_ALL = 'all_to_all'
 ALL_TO_ONE = 'all_to_one'
+# how many taken ids an instance id generator may generate in a row
+MAX_INSTANCE_ID_ATTEMPTS = 1000
+# the deployment graph attribute holding its node ids in the order of the
+# node instances the graph was built from
+NODE_IDS = 'node_ids'
 Container = namedtuple(
     'Container', [
         'node_instance',
@@ -44,8 +53,10 @@ _relationship_types = RelationshipMapping()  # pylint: disable=invalid-name
 
 def build_node_graph(nodes, scaling_groups):  # pylint: disable=too-many-locals
     graph, groups_graph = networkx.DiGraph(), networkx.DiGraph()
+    relationship_classes = _relationship_classes(graph)
     node_ids = set()
     contained_in_group = {}
+    top_level_groups = {}
     group_contained_in_type = _relationship_types.group_contained_in_relationship_type
     contained_in_type = _relationship_types.contained_in_relationship_type
 
@@ -87,7 +98,8 @@ def build_node_graph(nodes, scaling_groups):  # pylint: disable=too-many-locals
         node_id = node['id']
         for index, relationship in enumerate(node.get(RELATIONSHIPS, ())):
             target_id = relationship['target_id']
-            if any((contained_in_type not in relationship['type_hierarchy'],
+            if any((not relationship_classes.is_a(
+                    relationship, contained_in_type),
                     node_id not in contained_in_group)):
                 graph.add_edge(
                     node_id, target_id,
@@ -95,16 +107,18 @@ def build_node_graph(nodes, scaling_groups):  # pylint: disable=too-many-locals
                     index=index)
                 continue
             group_name = contained_in_group[node_id]
-            relationship.update(
+            # the edge gets its own copy of the relationship, so the given
+            # nodes are left untouched
+            relationship = dict(
+                relationship,
                 target_id=group_name,
                 replaced=target_id)
             graph.add_edge(
                 node_id, group_name,
                 relationship=relationship,
                 index=index)
-            top_level_group_name = networkx.topological_sort(
-                groups_graph,
-                nbunch=[group_name])[-1]
+            top_level_group_name = _top_level_group(
+                groups_graph, group_name, top_level_groups)
             graph.add_edge(
                 top_level_group_name,
                 target_id,
@@ -116,16 +130,52 @@ def build_node_graph(nodes, scaling_groups):  # pylint: disable=too-many-locals
     return graph
 
 
+def _top_level_group(groups_graph, group_name, top_level_groups):
+    """
+    The outermost group containing group_name (itself if not a member of
+    any group). Groups are members of at most one group, so the ancestry
+    is walked up once and memoized in top_level_groups for all the groups
+    on the way.
+    """
+    walked = []
+    while group_name not in top_level_groups:
+        walked.append(group_name)
+        parents = groups_graph.succ[group_name]
+        if not parents:
+            top_level_groups[group_name] = group_name
+            break
+        group_name = next(iter(parents))
+    top_level_group_name = top_level_groups[group_name]
+    for walked_group_name in walked:
+        top_level_groups[walked_group_name] = top_level_group_name
+    return top_level_group_name
+
+
 def build_previous_deployment_node_graph(plan_node_graph, previous_node_instances):  # pylint: disable=too-many-locals
     graph, contained_graph = networkx.DiGraph(), networkx.DiGraph()
-
+    relationship_classes = _relationship_classes(plan_node_graph)
+    contained_in_type = _relationship_types.contained_in_relationship_type
+    # relationships replaced by scaling groups are rewritten below, so the
+    # given node instances are left untouched by working on copies
+    previous_node_instances = [
+        dict(node_instance, relationships=[
+            dict(relationship)
+            for relationship in node_instance.get('relationships', ())])
+        for node_instance in previous_node_instances]
+
+    # graphs do not keep the order of their nodes, so it is recorded for
+    # the node instances to scale in to be picked deterministically
+    node_ids = graph.graph[NODE_IDS] = []
     for node_instance in previous_node_instances:
         node_instance_id = node_instance['id']
         node_instance_host_id = node_instance.get('host_id')
+        node_ids.append(node_instance_id)
         graph.add_node(node_instance_id, node=node_instance)
         contained_graph.add_node(node_instance_id, node=node_instance)
         for scaling_group in node_instance.get('scaling_groups') or ():
             group_id = scaling_group['id']
+            if group_id not in graph:
+                node_ids.append(group_id)
             node = {
                 'id': group_id,
                 'name': scaling_group['name'],
@@ -168,9 +218,9 @@ def build_previous_deployment_node_graph(plan_node_graph, previous_node_instance
                 node_instance_id, target_id,
                 relationship=relationship,
                 index=index)
-            if _is_type_in_relationship_type_hierarchy(
+            if relationship_classes.is_a(
                     plan_node_graph[node_id][target_name]['relationship'],
-                    [_relationship_types.contained_in_relationship_type]):
+                    contained_in_type):
                 contained_graph.add_edge(node_instance_id, target_id)
 
         if not scaling_groups:
@@ -210,7 +260,44 @@ def build_deployment_node_graph(  # pylint: disable=invalid-name
         plan_node_graph,
         previous_deployment_node_graph=None,
         previous_deployment_contained_graph=None,
-        modified_nodes=None):
+        modified_nodes=None,
+        instance_id_generator=None,
+        compact_all_to_all=False,
+        processes=None):
+    """
+    Build the deployment node graph of a plan node graph (or of a
+    modification, when given the previous deployment graphs).
+
+    With compact_all_to_all, all_to_all relationship instances are not added
+    as graph edges. Instead, each is recorded once per source instance and
+    partition of target instances in ctx.all_to_all_relationships and
+    expanded by extract_node_instances. The resulting graph can therefore
+    not be used as the previous graph of a modification.
+
+    With processes, the contained trees are expanded in a pool of that many
+    worker processes. Each tree is expanded with its own copy of the
+    instance id generator, so the ids do not depend on the number of
+    processes or on their scheduling; the generator must therefore be
+    picklable (which is checked before anything is expanded) and generate
+    ids unique across nodes (as all the provided generators do, by
+    prefixing them with the node id). Expanding in processes is not
+    supported for modifications. The trees and their node instances are
+    pickled to and from the workers, which costs more than expanding them
+    unless generating ids is expensive.
+    """
+    if compact_all_to_all and previous_deployment_node_graph is not None:
+        raise ValueError(
+            'compact_all_to_all is not supported for deployment modification')
+    if processes and previous_deployment_node_graph is not None:
+        raise ValueError(
+            'processes are not supported for deployment modification')
+    if processes:
+        try:
+            cPickle.dumps(instance_id_generator, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError) as exc:
+            raise ValueError(
+                'processes require a picklable instance_id_generator, '
+                'got {0!r}: {1}'.format(instance_id_generator, exc))
     deployment_node_graph = networkx.DiGraph()
 
     _verify_no_unsupported_relationships(plan_node_graph)
@@ -219,7 +306,10 @@ def build_deployment_node_graph(  # pylint: disable=invalid-name
         deployment_node_graph=deployment_node_graph,
         previous_deployment_node_graph=previous_deployment_node_graph,
         previous_deployment_contained_graph=previous_deployment_contained_graph,
-        modified_nodes=modified_nodes)
+        modified_nodes=modified_nodes,
+        instance_id_generator=instance_id_generator,
+        compact_all_to_all=compact_all_to_all,
+        processes=processes)
     _handle_contained_in(ctx)
 
     ctx.node_instance_ids.clear()
@@ -227,20 +317,70 @@ def build_deployment_node_graph(  # pylint: disable=invalid-name
     for node_instance_id, data in deployment_node_graph.nodes_iter(data=True):
         ctx.node_instance_ids.add(node_instance_id)
         node_id = _node_id_from_node_instance(data['node'])
-        ctx.node_ids_to_node_instance_ids[node_id].add(node_instance_id)
+        ctx.node_ids_to_node_instance_ids[node_id].append(node_instance_id)
     _handle_connected_to_and_depends_on(ctx)
-    ctx.restore_plan_node_graph()
 
     return deployment_node_graph, ctx
 
 
-def extract_node_instances(  # pylint: disable=too-many-locals
+def extract_node_instances(
         node_instances_graph,
         ctx,
         copy_instances=False,
         contained_graph=None):
+    return list(iter_node_instances(
+        node_instances_graph,
+        ctx=ctx,
+        copy_instances=copy_instances,
+        contained_graph=contained_graph))
+
+
+def iter_node_instances(  # pylint: disable=too-many-locals
+        node_instances_graph,
+        ctx,
+        copy_instances=False,
+        contained_graph=None,
+        chunk_size=None):
+    """
+    Generator variant of extract_node_instances, yielding the node
+    instances one at a time (or in lists of up to chunk_size node
+    instances) as they are built, so that they may be persisted without
+    holding all of them in memory.
+
+    With copy_instances, the graph data is left untouched: node instances
+    and the relationships that are rewritten are shallow copies, while the
+    values they hold (and any other relationship) are shared with the
+    graph, so they should be treated as read only.
+    """
+    if chunk_size:
+        return chunk_node_instances(
+            iter_node_instances(
+                node_instances_graph,
+                ctx=ctx,
+                copy_instances=copy_instances,
+                contained_graph=contained_graph),
+            chunk_size)
+    return _iter_node_instances(
+        node_instances_graph, ctx, copy_instances, contained_graph)
+
+
+def chunk_node_instances(node_instances, chunk_size):
+    chunk = []
+    for node_instance in node_instances:
+        chunk.append(node_instance)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_node_instances(  # pylint: disable=too-many-locals
+        node_instances_graph,
+        ctx,
+        copy_instances,
+        contained_graph):
     contained_graph = contained_graph or ctx.deployment_contained_graph
-    node_instances = []
     group_contained_in_type = _relationship_types.group_contained_in_relationship_type
 
     for node_instance_id, data in node_instances_graph.nodes_iter(data=True):
@@ -249,7 +389,7 @@ def extract_node_instances(  # pylint: disable=too-many-locals
             continue
         node_instance_attributes = data.get('node_instance_attributes')
         if copy_instances:
-            node_instance = copy.deepcopy(node_instance)
+            node_instance = _node_instance_output_copy(node_instance)
         if node_instance_attributes:
             node_instance.update(node_instance_attributes)
         indexed_relationship_instances = []
@@ -258,7 +398,7 @@ def extract_node_instances(  # pylint: disable=too-many-locals
             relationship_instance = edge_data['relationship']
             relationship_index = edge_data['index']
             if copy_instances:
-                relationship_instance = copy.deepcopy(relationship_instance)
+                relationship_instance = dict(relationship_instance)
             group_rel = relationship_instance['type'] == group_contained_in_type
             replaced = relationship_instance.pop('replaced', None)
             if replaced or group_rel:
@@ -277,24 +417,46 @@ def extract_node_instances(  # pylint: disable=too-many-locals
             if not group_rel:
                 indexed_relationship_instances.append(
                     (relationship_index, relationship_instance))
+        for relationship_index, relationship, target_node_instance_ids in (
+                ctx.all_to_all_relationships.get(node_instance_id, ())):
+            indexed_relationship_instances.extend(
+                (relationship_index,
+                 _relationship_instance_copy(
+                     relationship=relationship,
+                     target_node_instance_id=target_node_instance_id))
+                for target_node_instance_id in target_node_instance_ids)
         indexed_relationship_instances.sort(key=lambda (index, _): index)
         node_instance[RELATIONSHIPS] = [
             relationship
             for _, relationship in indexed_relationship_instances
         ]
-        node_instances.append(node_instance)
-    return node_instances
+        yield node_instance
+
+
+def _node_instance_output_copy(node_instance):
+    """
+    Copy a node instance, including its nested values (e.g. its runtime
+    properties), but for its relationships, which are copied as the
+    instance's edges are extracted.
+    """
+    return dict(
+        (key, copy.deepcopy(value)
+         if key != RELATIONSHIPS and isinstance(value, (dict, list))
+         else value)
+        for key, value in node_instance.iteritems())
 
 
 def extract_added_node_instances(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        ctx):
+        ctx,
+        lazy=False):
     added_instances_graph = _graph_diff(
         new_deployment_node_graph,
         previous_deployment_node_graph,
         node_instance_attributes={'modification': 'added'})
-    return extract_node_instances(
+    extract = iter_node_instances if lazy else extract_node_instances
+    return extract(
         added_instances_graph,
         ctx=ctx,
         copy_instances=True,
@@ -304,12 +466,14 @@ def extract_added_node_instances(
 def extract_removed_node_instances(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        ctx):
+        ctx,
+        lazy=False):
     removed_instances_graph = _graph_diff(
         previous_deployment_node_graph,
         new_deployment_node_graph,
         node_instance_attributes={'modification': 'removed'})
-    return extract_node_instances(
+    extract = iter_node_instances if lazy else extract_node_instances
+    return extract(
         removed_instances_graph,
         ctx=ctx,
         copy_instances=True,
@@ -319,12 +483,14 @@ def extract_removed_node_instances(
 def extract_added_relationships(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        ctx):
+        ctx,
+        lazy=False):
     modified_instance_graph = _graph_diff_relationships(
         new_deployment_node_graph,
         previous_deployment_node_graph,
         node_instance_attributes={'modification': 'extended'})
-    return extract_node_instances(
+    extract = iter_node_instances if lazy else extract_node_instances
+    return extract(
         modified_instance_graph,
         ctx=ctx,
         copy_instances=True,
@@ -334,12 +500,14 @@ def extract_added_relationships(
 def extract_removed_relationships(
         previous_deployment_node_graph,
         new_deployment_node_graph,
-        ctx):
+        ctx,
+        lazy=False):
     modified_instance_graph = _graph_diff_relationships(
         previous_deployment_node_graph,
         new_deployment_node_graph,
         node_instance_attributes={'modification': 'reduced'})
-    return extract_node_instances(
+    extract = iter_node_instances if lazy else extract_node_instances
+    return extract(
         modified_instance_graph,
         ctx=ctx,
         copy_instances=True,
@@ -355,13 +523,14 @@ def _graph_diff(
         if node in subset_graph:
             continue
         result.add_node(
-            node, data,
+            node,
+            node=data['node'],
             node_instance_attributes=node_instance_attributes)
         for neighbors in graph.neighbors_iter(node):
-            result.add_node(neighbors, graph.node[neighbors])
+            result.add_node(neighbors, node=graph.node[neighbors]['node'])
             result.add_edge(node, neighbors, graph[node][neighbors])
         for predecessor in graph.predecessors_iter(node):
-            result.add_node(predecessor, graph.node[predecessor])
+            result.add_node(predecessor, node=graph.node[predecessor]['node'])
             result.add_edge(predecessor, node, graph[predecessor][node])
     return result
 
@@ -381,70 +550,323 @@ def _graph_diff_relationships(
     for source, dest, _ in graph.edges_iter(data=True):
         if source not in subset_graph or dest in subset_graph[source]:
             continue
-        new_node = copy.deepcopy(graph.node[source])
         result.add_node(
-            source, new_node,
+            source,
+            node=graph.node[source]['node'],
             node_instance_attributes=node_instance_attributes)
-        result.add_node(dest, graph.node[dest])
+        result.add_node(dest, node=graph.node[dest]['node'])
         result.add_edge(source, dest, graph[source][dest])
     return result
 
 
 def _handle_contained_in(ctx):
-    # for each 'contained' tree, recursively build new trees based on
+    # for each 'contained' tree, build new trees based on
     # scaling groups with generated ids
-    for contained_tree in networkx.weakly_connected_component_subgraphs(
-            ctx.plan_contained_graph.reverse(copy=True)):
-        # extract tree root node id
-        node_id = networkx.topological_sort(contained_tree)[0]
-        _build_multi_instance_node_tree_rec(
-            node_id=node_id,
-            contained_tree=contained_tree,
+    contained_children = _contained_children(ctx.plan_contained_graph)
+    if ctx.processes:
+        _build_node_trees_in_pool(ctx, contained_children)
+    else:
+        _build_node_trees(ctx, contained_children)
+    ctx.deployment_contained_graph = _ContainedGraphView(
+        ctx.deployment_node_graph)
+
+
+def _build_node_trees(ctx, contained_children):
+    contained_graph = ctx.plan_contained_graph
+    previous_containment = None
+    for node_id in contained_graph.nodes_iter():
+        if contained_graph.succ[node_id]:
+            continue
+        if ctx.is_modification:
+            # trees that are not affected by the modification are taken
+            # as they are from the previous deployment graph, rather than
+            # being expanded again
+            if previous_containment is None:
+                previous_containment = _count_previous_contained_instances(
+                    ctx)
+            tree_node_ids = _contained_tree_node_ids(
+                node_id, contained_children)
+            if _is_unmodified_contained_tree(
+                    ctx, tree_node_ids, *previous_containment):
+                _copy_previous_contained_tree(ctx, tree_node_ids)
+                continue
+        _build_multi_instance_node_tree(
+            root_node_id=node_id,
+            contained_children=contained_children,
             ctx=ctx)
-    ctx.deployment_contained_graph = ctx.deployment_node_graph.copy()
 
 
-def _build_multi_instance_node_tree_rec(
-        node_id,
-        contained_tree,
-        ctx,
-        parent_relationship=None,
-        parent_relationship_index=None,
-        parent_node_instance_id=None,
-        current_host_instance_id=None):
-    containers = _build_and_update_node_instances(
-        ctx=ctx,
-        node=contained_tree.node[node_id]['node'],
-        parent_node_instance_id=parent_node_instance_id,
-        parent_relationship=parent_relationship,
-        current_host_instance_id=current_host_instance_id)
-    for container in containers:
-        node_instance = container.node_instance
-        node_instance_id = node_instance['id']
-        relationship_instance = container.relationship_instance
-        new_current_host_instance_id = container.current_host_instance_id
-        ctx.deployment_node_graph.add_node(
-            node_instance_id,
-            node=node_instance)
-        if parent_node_instance_id is not None:
+def _contained_children(contained_graph):
+    # the contained graph edges point from contained to container, so the
+    # tree roots are the nodes without successors and the children of a
+    # node are its predecessors
+    return dict(
+        (node_id, list(contained_graph.predecessors_iter(node_id)))
+        for node_id in contained_graph.nodes_iter())
+
+
+def _build_node_trees_in_pool(ctx, contained_children):
+    """
+    Expand the contained trees in ctx.processes worker processes and add
+    the resulting node instances and relationships to the deployment graph
+    """
+    contained_graph = ctx.plan_contained_graph
+    tasks = [
+        (node_id,
+         _tree_plan_graph(
+             ctx.plan_node_graph,
+             _contained_tree_node_ids(node_id, contained_children)),
+         ctx.instance_id_generator)
+        for node_id in contained_graph.nodes_iter()
+        if not contained_graph.succ[node_id]]
+    pool = multiprocessing.Pool(ctx.processes)
+    try:
+        results = pool.map(
+            _build_node_tree,
+            tasks,
+            chunksize=max(1, len(tasks) // (ctx.processes * 4)))
+    finally:
+        pool.close()
+        pool.join()
+    graph = ctx.deployment_node_graph
+    for node_instances, edges in results:
+        for node_instance in node_instances:
+            node_instance_id = node_instance['id']
+            if node_instance_id in graph:
+                raise ValueError(
+                    "Node instance id '{0}' was generated in more than one "
+                    "contained tree: expanding in processes requires "
+                    "instance ids unique across nodes".format(
+                        node_instance_id))
+            graph.add_node(node_instance_id, node=node_instance)
+        graph.add_edges_from(edges)
+
+
+def _tree_plan_graph(plan_node_graph, tree_node_ids):
+    """
+    The part of the plan node graph a contained tree is expanded from, with
+    only the node and relationship fields the expansion uses, so that little
+    is sent to the worker processes
+    """
+    graph = networkx.DiGraph()
+    for node_id in tree_node_ids:
+        data = plan_node_graph.node[node_id]
+        node = data['node']
+        graph.add_node(
+            node_id,
+            node=dict((key, node[key])
+                      for key in ('id', 'name', 'host_id', 'group')
+                      if key in node),
+            scale_properties=data['scale_properties'])
+    for node_id in tree_node_ids:
+        for target_id, edge_data in plan_node_graph.succ[node_id].iteritems():
+            if target_id not in graph:
+                continue
+            relationship = edge_data['relationship']
+            graph.add_edge(
+                node_id, target_id,
+                relationship=dict(
+                    (key, relationship[key])
+                    for key in ('type', 'type_hierarchy', 'target_id',
+                                'replaced')
+                    if key in relationship),
+                index=edge_data['index'])
+    return graph
+
+
+def _build_node_tree(task):
+    """
+    Expand a contained tree in a worker process, returning its node
+    instances and the relationships between them
+    """
+    root_node_id, plan_node_graph, instance_id_generator = task
+    ctx = Context(
+        plan_node_graph=plan_node_graph,
+        deployment_node_graph=networkx.DiGraph(),
+        instance_id_generator=instance_id_generator)
+    _build_multi_instance_node_tree(
+        root_node_id=root_node_id,
+        contained_children=_contained_children(ctx.plan_contained_graph),
+        ctx=ctx)
+    graph = ctx.deployment_node_graph
+    return (
+        [data['node'] for _, data in graph.nodes_iter(data=True)],
+        graph.edges(data=True))
+
+
+def _contained_tree_node_ids(root_node_id, contained_children):
+    tree_node_ids = [root_node_id]
+    for node_id in tree_node_ids:
+        tree_node_ids.extend(contained_children[node_id])
+    return tree_node_ids
+
+
+def _count_previous_contained_instances(ctx):
+    """
+    Count the previous node instances contained in each previous node
+    instance, by node: returns the counts by (node id, container node
+    instance id) and the total counts of contained instances by node id
+    """
+    graph = ctx.previous_deployment_contained_graph
+    counts = defaultdict(int)
+    totals = defaultdict(int)
+    for node_instance_id, container_id in graph.edges_iter():
+        node_id = _node_id_from_node_instance(
+            graph.node[node_instance_id]['node'])
+        counts[node_id, container_id] += 1
+        totals[node_id] += 1
+    return counts, totals
+
+
+def _is_unmodified_contained_tree(ctx, tree_node_ids, counts, totals):
+    """
+    Whether expanding the contained tree of the plan nodes tree_node_ids
+    would result in exactly the previous node instances: none of its nodes
+    is modified and every container node instance holds the current
+    number of instances of each contained node.
+    """
+    previous_node_instance_ids = ctx.node_ids_to_node_instance_ids
+    for node_id in tree_node_ids:
+        if node_id in ctx.modified_nodes:
+            return False
+        current_instances_num = ctx.plan_node_graph.node[
+            node_id]['scale_properties']['current_instances']
+        instances_num = len(previous_node_instance_ids.get(node_id, ()))
+        container_ids = ctx.plan_contained_graph.succ[node_id]
+        if not container_ids:
+            if (instances_num != current_instances_num or
+                    totals.get(node_id)):
+                return False
+            continue
+        container_id = next(iter(container_ids))
+        container_instance_ids = previous_node_instance_ids.get(
+            container_id, ())
+        if totals.get(node_id, 0) != instances_num:
+            return False
+        if instances_num != current_instances_num * len(
+                container_instance_ids):
+            return False
+        for container_instance_id in container_instance_ids:
+            if counts.get((node_id, container_instance_id),
+                          0) != current_instances_num:
+                return False
+    return True
+
+
+def _copy_previous_contained_tree(ctx, tree_node_ids):
+    """
+    Add the previous node instances of an unmodified contained tree to the
+    deployment graph, as _build_multi_instance_node_tree would have.
+    """
+    previous_contained_graph = ctx.previous_deployment_contained_graph
+    for node_id in tree_node_ids:
+        node = ctx.plan_contained_graph.node[node_id]['node']
+        container_ids = ctx.plan_contained_graph.succ[node_id]
+        for node_instance_id in ctx.node_ids_to_node_instance_ids[node_id]:
+            node_instance = ctx.previous_deployment_node_graph.node[
+                node_instance_id]['node']
+            ctx.deployment_node_graph.add_node(
+                node_instance_id,
+                node=node_instance)
+            if not container_ids:
+                continue
+            container_id = next(iter(container_ids))
+            parent_node_instance_id = next(iter(
+                previous_contained_graph.succ[node_instance_id]))
             ctx.deployment_node_graph.add_edge(
                 node_instance_id, parent_node_instance_id,
-                relationship=relationship_instance,
-                index=parent_relationship_index)
-        for child_node_id in contained_tree.neighbors_iter(node_id):
-            descendants = networkx.descendants(contained_tree, child_node_id)
-            descendants.add(child_node_id)
-            child_contained_tree = contained_tree.subgraph(descendants)
-            _build_multi_instance_node_tree_rec(
-                node_id=child_node_id,
-                contained_tree=child_contained_tree,
-                ctx=ctx,
-                parent_relationship=ctx.plan_node_graph[
-                    child_node_id][node_id]['relationship'],
-                parent_relationship_index=ctx.plan_node_graph[
-                    child_node_id][node_id]['index'],
-                parent_node_instance_id=node_instance_id,
-                current_host_instance_id=new_current_host_instance_id)
+                relationship=_extract_contained(
+                    node, node_instance, ctx.relationship_classes),
+                index=ctx.plan_node_graph[node_id][container_id]['index'])
+
+
+class _ContainedGraphView(object):  # pylint: disable=too-few-public-methods
+    """
+    The contained graph of a deployment graph, taken while the deployment
+    graph holds the contained relationships only. Node instances have at
+    most one container, so rather than copying the graph, the view keeps
+    the graph's node table and a table of the container edges, which stays
+    as it is when other relationships are added to the graph. It provides
+    the node and succ lookups of a networkx graph, read only.
+    """
+    def __init__(self, graph):
+        self.node = graph.node
+        self.succ = _ContainerAdjacency(dict(
+            (node_id, next(succ.iteritems()))
+            for node_id, succ in graph.succ.iteritems()
+            if succ))
+
+
+class _ContainerAdjacency(object):  # pylint: disable=too-few-public-methods
+    def __init__(self, container_edges):
+        # node id -> (container id, edge data)
+        self._container_edges = container_edges
+
+    def __getitem__(self, node_id):
+        container_edge = self._container_edges.get(node_id)
+        return dict((container_edge,)) if container_edge else {}
+
+
+def _edgeless_graph_view(graph):
+    """
+    A graph with the nodes of graph and no edges, whose node table is
+    graph's own (not a copy): it must not be used to add or remove nodes.
+    """
+    result = networkx.DiGraph()
+    result.node = graph.node
+    for node_id in graph.node:
+        result.succ[node_id] = {}
+        result.pred[node_id] = {}
+    return result
+
+
+def _build_multi_instance_node_tree(
+        root_node_id,
+        contained_children,
+        ctx):
+    """
+    Expand the contained tree rooted at root_node_id, depth first. Each
+    plan node is expanded once for every instance of its container, so the
+    work done is linear in the number of resulting node instances.
+    """
+    # each entry: (node_id, parent_node_id, parent_node_instance_id,
+    #              current_host_instance_id)
+    stack = [(root_node_id, None, None, None)]
+    while stack:
+        (node_id, parent_node_id, parent_node_instance_id,
+         current_host_instance_id) = stack.pop()
+        if parent_node_id is not None:
+            parent_edge = ctx.plan_node_graph[node_id][parent_node_id]
+            parent_relationship = parent_edge['relationship']
+            parent_relationship_index = parent_edge['index']
+        else:
+            parent_relationship = parent_relationship_index = None
+        containers = _build_and_update_node_instances(
+            ctx=ctx,
+            node=ctx.plan_contained_graph.node[node_id]['node'],
+            parent_node_instance_id=parent_node_instance_id,
+            parent_relationship=parent_relationship,
+            current_host_instance_id=current_host_instance_id)
+        children = contained_children[node_id]
+        # pushed in reverse, so instances (and their children) are expanded
+        # in order
+        for container in reversed(containers):
+            node_instance = container.node_instance
+            node_instance_id = node_instance['id']
+            ctx.deployment_node_graph.add_node(
+                node_instance_id,
+                node=node_instance)
+            if parent_node_instance_id is not None:
+                ctx.deployment_node_graph.add_edge(
+                    node_instance_id, parent_node_instance_id,
+                    relationship=container.relationship_instance,
+                    index=parent_relationship_index)
+            for child_node_id in reversed(children):
+                stack.append((
+                    child_node_id,
+                    node_id,
+                    node_instance_id,
+                    container.current_host_instance_id))
 
 
 def _build_and_update_node_instances(  # pylint: disable=too-many-locals
@@ -459,15 +881,8 @@ def _build_and_update_node_instances(  # pylint: disable=too-many-locals
     new_instances_num = 0
     previous_containers = []
     if ctx.is_modification:
-        all_previous_node_instance_ids = ctx.node_ids_to_node_instance_ids[node_id]
-        previous_node_instance_ids = [
-            instance_id
-            for instance_id in all_previous_node_instance_ids
-            if any((not parent_node_instance_id,
-                    all((instance_id in ctx.previous_deployment_node_graph,
-                         ctx.previous_deployment_node_graph[instance_id].get(
-                             parent_node_instance_id)))))
-        ]
+        previous_node_instance_ids = ctx.previous_node_instance_ids(
+            node_id, parent_node_instance_id)
         previous_instances_num = len(previous_node_instance_ids)
         if node_id in ctx.modified_nodes:
             modified_node = ctx.modified_nodes[node_id]
@@ -492,7 +907,8 @@ def _build_and_update_node_instances(  # pylint: disable=too-many-locals
             Container(node_instance,
                       _extract_contained(
                           node,
-                          node_instance),
+                          node_instance,
+                          ctx.relationship_classes),
                       node_instance.get('host_id'))
             for node_instance in previous_node_instances]
     else:
@@ -500,7 +916,8 @@ def _build_and_update_node_instances(  # pylint: disable=too-many-locals
 
     new_containers = []
     for _ in xrange(new_instances_num):
-        node_instance_id = _node_instance_id(node_id, ctx)
+        node_instance_id = _node_instance_id(
+            node_id, ctx, parent_node_instance_id)
         node_instance = _node_instance_copy(
             node=node,
             node_instance_id=node_instance_id)
@@ -527,32 +944,44 @@ def _handle_removed_instances(
         previous_instances_num,
         total_instances_num,
         modified_node):
+    """
+    Remove the ids of the node instances to scale in from
+    previous_node_instance_ids (in place, keeping the order of the rest):
+    first those in removed_ids_include_hint, then those not in
+    removed_ids_exclude_hint and, if still short, the excluded ones, each
+    in the order of previous_node_instance_ids.
+    """
     removed_instances_num = previous_instances_num - total_instances_num
-    removed_ids_include_hint = modified_node.get('removed_ids_include_hint', [])
-    removed_ids_exclude_hint = modified_node.get('removed_ids_exclude_hint', [])
-    for removed_instance_id in removed_ids_include_hint:
-        if removed_instances_num <= 0:
+    if removed_instances_num <= 0:
+        return
+    candidate_ids = set(previous_node_instance_ids)
+    removed_ids = set()
+    for removed_instance_id in modified_node.get(
+            'removed_ids_include_hint', []):
+        if len(removed_ids) >= removed_instances_num:
             break
-        if removed_instance_id not in previous_node_instance_ids:
-            continue
-        previous_node_instance_ids.remove(removed_instance_id)
-        removed_instances_num -= 1
-    for removed_instance_id in copy.copy(previous_node_instance_ids):
-        if removed_instances_num <= 0:
+        if removed_instance_id in candidate_ids:
+            removed_ids.add(removed_instance_id)
+    excluded_ids = set(modified_node.get('removed_ids_exclude_hint', []))
+    for removed_instance_id in previous_node_instance_ids:
+        if len(removed_ids) >= removed_instances_num:
             break
-        if removed_instance_id in removed_ids_exclude_hint:
-            continue
-        previous_node_instance_ids.remove(removed_instance_id)
-        removed_instances_num -= 1
-    remaining_removed_instance_ids = previous_node_instance_ids[:removed_instances_num]
-    for removed_instance_id in remaining_removed_instance_ids:
-        previous_node_instance_ids.remove(removed_instance_id)
+        if removed_instance_id not in excluded_ids:
+            removed_ids.add(removed_instance_id)
+    for removed_instance_id in previous_node_instance_ids:
+        if len(removed_ids) >= removed_instances_num:
+            break
+        removed_ids.add(removed_instance_id)
+    previous_node_instance_ids[:] = [
+        instance_id
+        for instance_id in previous_node_instance_ids
+        if instance_id not in removed_ids]
 
 
-def _extract_contained(node, node_instance):
+def _extract_contained(node, node_instance, relationship_classes):
     contained_in_type = _relationship_types.contained_in_relationship_type
     for node_relationship in node.get('relationships', []):
-        if contained_in_type in node_relationship['type_hierarchy']:
+        if relationship_classes.is_a(node_relationship, contained_in_type):
             contained_node_relationship = node_relationship
             break
     else:
@@ -679,6 +1108,13 @@ def _add_connected_to_and_depends_on_relationships(  # pylint: disable=invalid-n
             (source_node_instance_ids, target_node_instance_ids)]
 
     for source_node_instance_ids, target_node_instance_ids in partitioned_node_instance_ids:
+        if connection_type == ALL_TO_ALL and ctx.compact_all_to_all:
+            all_to_all_relationship = (
+                index, relationship, tuple(target_node_instance_ids))
+            for source_node_instance_id in source_node_instance_ids:
+                ctx.all_to_all_relationships[source_node_instance_id].append(
+                    all_to_all_relationship)
+            continue
         for source_node_instance_id, target_node_instance_id in product(
                 source_node_instance_ids, target_node_instance_ids):
             relationship_instance = _relationship_instance_copy(
@@ -727,16 +1163,80 @@ def _build_scaling_groups_map(ctx, node_instance_ids, group):
     return scaling_groups_map
 
 
-def _node_instance_id(node_id, ctx):
-    new_node_instance_id = '{0}_{1}'.format(node_id, _generate_id())
-    while new_node_instance_id in ctx.node_instance_ids:
-        new_node_instance_id = '{0}_{1}'.format(node_id, _generate_id())
-    ctx.node_instance_ids.add(new_node_instance_id)
-    return new_node_instance_id
+class RandomInstanceIdGenerator(object):
+    """
+    Generates ids of the form <node_id>_<random hex digits>.
+
+    The default 5 hex digits keep ids short, but make collisions (and so
+    retries) frequent once a node has hundreds of thousands of instances;
+    use more digits for such nodes. A seed makes the generated ids
+    reproducible.
+    """
+    def __init__(self, digits=5, seed=None):
+        self._space = 16 ** digits
+        self._random = random.Random(seed)
+
+    def __call__(self, node_id, parent_node_instance_id):
+        return '{0}_{1:x}'.format(node_id, self._random.randrange(self._space))
+
+
+class SequentialInstanceIdGenerator(object):
+    """
+    Generates ids of the form <node_id>_<n>, n counting from 1 per node, or
+    on modification from the highest existing n of the node.
+    """
+    def __init__(self):
+        self._counters = defaultdict(int)
+
+    def __call__(self, node_id, parent_node_instance_id):
+        self._counters[node_id] += 1
+        return '{0}_{1}'.format(node_id, self._counters[node_id])
 
+    def continue_from(self, node_instances):
+        for node_id, _, node_instance_id in node_instances:
+            prefix, _, number = node_instance_id.rpartition('_')
+            if prefix == node_id and number.isdigit():
+                self._counters[node_id] = max(
+                    self._counters[node_id], int(number))
 
-def _generate_id():
-    return '{0:x}'.format(randrange(16 ** 5))
+
+class PathHashInstanceIdGenerator(object):
+    """
+    Generates ids of the form <node_id>_<hex digits>, the digits being a
+    hash of the instance path: its containing node instance id, its node id
+    and its ordinal under that container (on modification, following the
+    existing instances under that container). Ids are therefore
+    reproducible and stable for a given containment structure.
+    """
+    def __init__(self, digits=8):
+        self._digits = digits
+        self._counters = defaultdict(int)
+
+    def __call__(self, node_id, parent_node_instance_id):
+        key = (parent_node_instance_id, node_id)
+        self._counters[key] += 1
+        path = u'{0}/{1}/{2}'.format(
+            parent_node_instance_id or '', node_id, self._counters[key])
+        return '_'.join((
+            node_id,
+            hashlib.sha1(path.encode('utf-8')).hexdigest()[:self._digits]))
+
+    def continue_from(self, node_instances):
+        for node_id, parent_node_instance_id, _ in node_instances:
+            self._counters[(parent_node_instance_id, node_id)] += 1
+
+
+def _node_instance_id(node_id, ctx, parent_node_instance_id=None):
+    generate = ctx.instance_id_generator
+    for _ in xrange(MAX_INSTANCE_ID_ATTEMPTS):
+        new_node_instance_id = generate(node_id, parent_node_instance_id)
+        if new_node_instance_id not in ctx.node_instance_ids:
+            ctx.node_instance_ids.add(new_node_instance_id)
+            return new_node_instance_id
+    raise NodeInstanceIdsExhausted(
+        'Failed generating a free node instance id for node {0} in {1} '
+        'attempts, the last was {2}; the generator may be out of '
+        'ids'.format(node_id, MAX_INSTANCE_ID_ATTEMPTS, new_node_instance_id))
 
 
 def _node_instance_copy(node, node_instance_id):
@@ -776,10 +1276,9 @@ def _verify_no_unsupported_relationships(graph):
     :param graph:
     :return:
     """
+    relationship_classes = _relationship_classes(graph)
     for _, _, edge in graph.edges_iter(data=True):
-        if not _is_type_in_relationship_type_hierarchy(
-                edge['relationship'],
-                _relationship_types.type_values()):
+        if not relationship_classes.of(edge['relationship']):
             raise UnsupportedRelationship(edge['relationship']['type'])
 
 
@@ -793,17 +1292,62 @@ def _verify_and_get_connection_type(relationship):
     return properties_relationship
 
 
-def _is_type_in_relationship_type_hierarchy(relationship, expected_types):
-    relationship_type_hierarchy = relationship['type_hierarchy']
-    return any((
-        relationship_type in expected_types
-        for relationship_type in relationship_type_hierarchy))
+class RelationshipClasses(object):
+    """
+    Classifies relationships by the relationship types of the relationship
+    mapping (contained in, connected to, depends on and group contained in)
+    found in their type hierarchy. Each relationship type is classified
+    once, so a table must only be used for the relationships of one plan,
+    in which relationship type names are unique.
+    """
+    def __init__(self):
+        self._mapped_types = frozenset(_relationship_types.type_values())
+        # relationship type -> frozenset of mapped types in its hierarchy
+        self._table = {}
+
+    def of(self, relationship):
+        relationship_type = relationship['type']
+        try:
+            return self._table[relationship_type]
+        except KeyError:
+            classes = self._table[relationship_type] = (
+                self._mapped_types.intersection(
+                    relationship['type_hierarchy']))
+            return classes
+
+    def is_a(self, relationship, relationship_type):
+        return relationship_type in self.of(relationship)
+
+    def is_any(self, relationship, relationship_types):
+        return not self.of(relationship).isdisjoint(relationship_types)
+
+
+def _relationship_classes(plan_node_graph):
+    """
+    The relationship classes of a plan node graph, kept in the graph's
+    attributes so they are shared by everything built from it
+    """
+    graph_attributes = plan_node_graph.graph
+    if 'relationship_classes' not in graph_attributes:
+        graph_attributes['relationship_classes'] = RelationshipClasses()
+    return graph_attributes['relationship_classes']
 
 
 def _node_id_from_node(node):
     return node.get('name') or node.get('id')
 
 
+def ordered_node_ids(graph):
+    """
+    The node ids of a deployment graph, in the order of the node instances
+    it was built from (sorted, if that is not known)
+    """
+    node_ids = graph.graph.get(NODE_IDS)
+    if node_ids is None or len(node_ids) != len(graph):
+        return sorted(graph.nodes_iter())
+    return node_ids
+
+
 def _node_id_from_node_instance(instance):
     return instance.get('name') or instance.get('node_id')
 
@@ -815,138 +1359,211 @@ class Context(object):
             deployment_node_graph,
             previous_deployment_node_graph=None,
             previous_deployment_contained_graph=None,
-            modified_nodes=None):
+            modified_nodes=None,
+            instance_id_generator=None,
+            compact_all_to_all=False,
+            processes=None):
         self.plan_node_graph = plan_node_graph
         self.deployment_node_graph = deployment_node_graph
         self.previous_deployment_node_graph = previous_deployment_node_graph
         self.previous_deployment_contained_graph = previous_deployment_contained_graph  # pylint: disable=invalid-name
         self.modified_nodes = modified_nodes
-
-        self.plan_contained_graph = self._build_contained_in_graph(self.plan_node_graph)
-        self.plan_connected_graph = self._connected_to_and_depends_on_graph(
-            self.plan_node_graph)
+        self.instance_id_generator = (
+            instance_id_generator or RandomInstanceIdGenerator())
+        self.compact_all_to_all = compact_all_to_all
+        self.processes = processes
+        # source node instance id -> list of
+        # (relationship index, relationship, target node instance ids)
+        self.all_to_all_relationships = defaultdict(list)
+        # id(contained graph) -> (contained graph, node id -> container ids)
+        self._containment_chains = {}
+        # node instance id -> group name -> containing group instance id
+        self._containing_group_ids = {}
+        # node id -> target node instance id -> previous node instance ids
+        self._previous_node_instance_ids = {}
+        self.relationship_classes = _relationship_classes(plan_node_graph)
+
+        self.plan_contained_graph, self.plan_connected_graph = (
+            self._partition_plan_node_graph())
 
         self.deployment_contained_graph = None
-        self.node_ids_to_node_instance_ids = defaultdict(set)
+        # node id -> node instance ids, in the order of the previous node
+        # instances on modifications
+        self.node_ids_to_node_instance_ids = defaultdict(list)
         self.node_instance_ids = set()
 
         if self.is_modification:
-            for node_instance_id, data in (
-                    self.previous_deployment_node_graph.nodes_iter(data=True)):
+            graph = self.previous_deployment_node_graph
+            for node_instance_id in ordered_node_ids(graph):
                 self.node_instance_ids.add(node_instance_id)
                 self.node_ids_to_node_instance_ids[
-                    _node_id_from_node_instance(data['node'])
-                ].add(node_instance_id)
+                    _node_id_from_node_instance(
+                        graph.node[node_instance_id]['node'])
+                ].append(node_instance_id)
+            continue_from = getattr(
+                self.instance_id_generator, 'continue_from', None)
+            if continue_from is not None:
+                continue_from(self._previous_node_instance_paths())
 
     @property
     def is_modification(self):
         return self.previous_deployment_node_graph is not None
 
+    def _previous_node_instance_paths(self):
+        contained_graph = self.previous_deployment_contained_graph
+        for node_id, node_instance_ids in (
+                self.node_ids_to_node_instance_ids.iteritems()):
+            for node_instance_id in node_instance_ids:
+                containers = (
+                    contained_graph.succ[node_instance_id]
+                    if contained_graph is not None else None)
+                yield (node_id,
+                       next(iter(containers)) if containers else None,
+                       node_instance_id)
+
     def minimal_containing_group(self, node_a, node_b):
-        a_groups = self._containing_groups(node_a)
-        b_groups = self._containing_groups(node_b)
-        shared_groups = set(a_groups) & set(b_groups)
-        if not shared_groups:
-            return None
-        return networkx.topological_sort(
-            self.plan_contained_graph,
-            nbunch=shared_groups)[0]
+        # the containing groups are ordered innermost first, so the first
+        # shared one is the minimal one
+        b_groups = set(self._containing_groups(node_b))
+        for group_name in self._containing_groups(node_a):
+            if group_name in b_groups:
+                return group_name
+        return None
 
     def _containing_groups(self, node_id):
         graph = self.plan_contained_graph
-        result = []
-        while True:
-            succ = graph.succ[node_id]
-            if not succ:
-                break
-            assert len(succ) == 1
-            node_id = succ.keys()[0]
-            if not graph.node[node_id]['node'].get('group'):
-                continue
-            result.append(node_id)
-        return result
+        return [
+            container_id
+            for container_id in self._containers(graph, node_id)
+            if graph.node[container_id]['node'].get('group')]
 
     def containing_group_id(self, node_instance_id, group_name):
-        graph = self.deployment_contained_graph
-        while True:
-            succ = graph.succ[node_instance_id]
-            if not succ:
-                return
-            assert len(succ) == 1
-            node_instance_id = succ.keys()[0]
-            node = graph.node[node_instance_id]['node']
-            if not node.get('group'):
-                continue
-            if _node_id_from_node_instance(node) == group_name:
-                return node['id']
-
-    @staticmethod
-    def containing_group_instances(instance_id, contained_graph):
+        group_ids = self._containing_group_ids.get(node_instance_id)
+        if group_ids is None:
+            graph = self.deployment_contained_graph
+            group_ids = {}
+            for container_id in self._containers(graph, node_instance_id):
+                node = graph.node[container_id]['node']
+                if node.get('group'):
+                    group_ids.setdefault(
+                        _node_id_from_node_instance(node), node['id'])
+            self._containing_group_ids[node_instance_id] = group_ids
+        return group_ids.get(group_name)
+
+    def containing_group_instances(self, instance_id, contained_graph):
         result = []
-        while True:
-            succ = contained_graph.succ[instance_id]
-            if not succ:
-                return result, None
-            assert len(succ) == 1
-            node_instance_id = succ.keys()[0]
-            node = contained_graph.node[node_instance_id]['node']
-            instance_id = node['id']
+        for container_id in self._containers(contained_graph, instance_id):
+            node = contained_graph.node[container_id]['node']
             result.append({
                 'name': _node_id_from_node_instance(node),
-                'id': instance_id,
+                'id': node['id'],
             })
             if not node.get('group'):
                 return result[:-1], result[-1]
+        return result, None
+
+    def _containers(self, graph, node_id):
+        """
+        The ids of the nodes containing node_id in the contained graph,
+        innermost first. The chains are memoized per graph, so each
+        contained graph is walked once overall rather than once per lookup.
+        """
+        cached_graph, chains = self._containment_chains.get(
+            id(graph), (None, None))
+        if cached_graph is not graph:
+            chains = {}
+            self._containment_chains[id(graph)] = (graph, chains)
+        # walk up to the first node with a known chain, then fill in the
+        # chains of the walked nodes top down
+        walked = []
+        while node_id not in chains:
+            succ = graph.succ[node_id]
+            if not succ:
+                chains[node_id] = ()
+                break
+            assert len(succ) == 1
+            walked.append(node_id)
+            node_id = succ.keys()[0]
+        chain = chains[node_id]
+        for walked_id in reversed(walked):
+            chain = (node_id,) + chain
+            chains[walked_id] = chain
+            node_id = walked_id
+        return chain
+
+    def previous_node_instance_ids(self, node_id, parent_node_instance_id):
+        """
+        The ids of the previous node instances of node_id related to
+        parent_node_instance_id (all of them, if it is None), as a new list
+        in the order of the previous node instances.
+        The node's instances are indexed by their relationship targets on
+        first use, so that expanding every container instance does not
+        scan them all over again.
+        """
+        node_instance_ids = self.node_ids_to_node_instance_ids[node_id]
+        if not parent_node_instance_id:
+            return list(node_instance_ids)
+        by_target = self._previous_node_instance_ids.get(node_id)
+        if by_target is None:
+            graph = self.previous_deployment_node_graph
+            by_target = self._previous_node_instance_ids[node_id] = (
+                defaultdict(list))
+            for node_instance_id in node_instance_ids:
+                if node_instance_id not in graph:
+                    continue
+                for target_id, data in graph.succ[
+                        node_instance_id].iteritems():
+                    if data:
+                        by_target[target_id].append(node_instance_id)
+        return list(by_target.get(parent_node_instance_id, ()))
+
+    def invalidate_containment(self):
+        """
+        Drop the memoized containment chains; to be called whenever a
+        contained graph is modified in place.
+        """
+        self._containment_chains.clear()
+        self._containing_group_ids.clear()
 
-    def restore_plan_node_graph(self):
-        for _, data in self.plan_node_graph.nodes_iter(data=True):
-            for relationship in data['node'].get('relationships', []):
-                try:
-                    replaced = relationship.pop('replaced')
-                    relationship['target_id'] = replaced
-                except KeyError:
-                    pass
-
-    def _connected_to_and_depends_on_graph(self, graph):  # pylint: disable=invalid-name
-        return self._graph_by_relationship_types(
-            graph,
-            build_from_types=[
-                _relationship_types.contained_to_relationship_type,
-                _relationship_types.depens_on_relationship_type,
-            ],
-            exclude_types=[
-                _relationship_types.contained_in_relationship_type,
-            ])
-
-    def _build_contained_in_graph(self, graph):
-        result = self._graph_by_relationship_types(
-            graph,
-            exclude_types=[],
-            build_from_types=[
-                _relationship_types.contained_in_relationship_type,
-                _relationship_types.group_contained_in_relationship_type,
-            ])
-        # don't forget to include nodes in this graph that no one is contained
-        # in them (these will be considered 1 node trees)
-        result.add_nodes_from(graph.nodes_iter(data=True))
-        return result
-
-    def _graph_by_relationship_types(
-            self,
-            graph,
-            build_from_types,
-            exclude_types):
-        relationship_base_graph = networkx.DiGraph()
-        for source, target, edge_data in graph.edges_iter(data=True):
-            include_edge = all([
-                _is_type_in_relationship_type_hierarchy(
-                    edge_data['relationship'], build_from_types),
-                not _is_type_in_relationship_type_hierarchy(
-                    edge_data['relationship'], exclude_types),
-            ])
-            if not include_edge:
+    @property
+    def deployment_contained_graph(self):
+        return self._deployment_contained_graph
+
+    @deployment_contained_graph.setter
+    def deployment_contained_graph(self, graph):
+        self._deployment_contained_graph = graph
+        self.invalidate_containment()
+
+    def _partition_plan_node_graph(self):
+        """
+        Split the edges of the plan node graph, in one pass, into the
+        contained graph (contained in and group contained in relationships)
+        and the connected graph (connected to and depends on relationships
+        that are not contained in relationships). Both graphs hold all the
+        plan nodes, so nodes no one is contained in are 1 node trees, and
+        share the plan node graph's node table and edge data.
+        """
+        contained_types = (
+            _relationship_types.contained_in_relationship_type,
+            _relationship_types.group_contained_in_relationship_type,
+        )
+        connected_types = (
+            _relationship_types.contained_to_relationship_type,
+            _relationship_types.depens_on_relationship_type,
+        )
+        contained_graph = _edgeless_graph_view(self.plan_node_graph)
+        connected_graph = _edgeless_graph_view(self.plan_node_graph)
+        for source, target, edge_data in self.plan_node_graph.edges_iter(
+                data=True):
+            relationship = edge_data['relationship']
+            if self.relationship_classes.is_any(
+                    relationship, contained_types):
+                graph = contained_graph
+            elif self.relationship_classes.is_any(
+                    relationship, connected_types):
+                graph = connected_graph
+            else:
                 continue
-            relationship_base_graph.add_node(source, graph.node[source])
-            relationship_base_graph.add_node(target, graph.node[target])
-            relationship_base_graph.add_edge(source, target, edge_data)
-        return relationship_base_graph
+            graph.succ[source][target] = edge_data
+            graph.pred[target][source] = edge_data
+        return contained_graph, connected_graph
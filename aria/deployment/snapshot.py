@@ -0,0 +1,316 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Snapshots of deployment graphs
+
+A snapshot holds the deployment node graph and the contained graph of a
+deployment (as returned by build_deployment_graphs), so they may be saved
+alongside the deployment and loaded back for modify_deployment instead of
+being rebuilt from the node instances.
+
+Layout, after a fixed size header:
+    * a payload of the node ids (the table every node is referred to
+      by its index in, in the order of the node instances the graph was
+      built from), the node instances and the relationships that are
+      not held by their source node instance (e.g. between scaling groups)
+    * the deployment graph adjacency, in compressed sparse row form: the
+      edges of the node at index i are at edge_offsets[i]:edge_offsets[i+1]
+      of the edge arrays, which hold the target node index, the
+      relationship (an index into the source node instance relationships,
+      or ~index into the payload relationships) and the relationship index
+    * the contained graph: its node indexes, and its adjacency in the same
+      form, with a flag per edge telling if it carries the data of the
+      respective deployment graph edge
+
+The payload is a pickle (protocol 2) of nothing but dicts, lists, tuples,
+strings, numbers, booleans and None, so the values are loaded back with
+their types (e.g. str and unicode, tuples, non-string keys) and loading
+never looks up a class or function; snapshots of other values are refused.
+The arrays are of 4 byte little endian integers (and 1 byte flags), so
+snapshots do not depend on the Python version or platform that wrote them.
+"""
+
+import cPickle
+import gc
+import struct
+import sys
+from array import array
+from cStringIO import StringIO
+
+import networkx
+
+from .relationships_graph import NODE_IDS, ordered_node_ids
+
+_MAGIC = 'ARIADG'
+_VERSION = 3
+_PICKLE_PROTOCOL = 2
+_STORABLE_TYPES = frozenset([
+    dict, list, tuple, str, unicode, int, long, float, bool, type(None)])
+_HEADER = struct.Struct('<6sB5Q')
+
+
+def _typecode(typecodes, itemsize):
+    return next(
+        typecode for typecode in typecodes
+        if array(typecode).itemsize == itemsize)
+
+
+_UNSIGNED = _typecode('IL', 4)
+_SIGNED = _typecode('il', 4)
+_FLAG = 'B'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def dump_deployment_graphs(deployment_graphs, stream):
+    """
+    Write a snapshot of deployment graphs
+    :param deployment_graphs: a (deployment graph, contained graph) tuple
+    :param stream: a binary file like object
+    """
+    _without_gc(_dump, deployment_graphs, stream)
+
+
+def _dump(deployment_graphs, stream):
+    graph, contained_graph = deployment_graphs
+    node_ids = list(ordered_node_ids(graph))
+    node_indexes = dict(
+        (node_id, index) for index, node_id in enumerate(node_ids))
+    node_instances = [_node_instance(graph, node_id) for node_id in node_ids]
+    relationships = []
+
+    edge_offsets = array(_UNSIGNED, [0])
+    edge_targets = array(_UNSIGNED)
+    edge_relationships = array(_SIGNED)
+    edge_indexes = array(_SIGNED)
+    for node_id, node_instance in zip(node_ids, node_instances):
+        held_relationships = dict(
+            (id(relationship), index) for index, relationship in
+            enumerate(node_instance.get('relationships') or ()))
+        for target_id, data in graph.succ[node_id].iteritems():
+            if set(data) != set(['relationship', 'index']):
+                raise SnapshotError(
+                    'Unexpected data of edge {0} -> {1}: {2}'.format(
+                        node_id, target_id, data))
+            relationship = data['relationship']
+            relationship_index = held_relationships.get(id(relationship))
+            if relationship_index is None:
+                relationship_index = ~len(relationships)
+                relationships.append(relationship)
+            edge_targets.append(node_indexes[target_id])
+            edge_relationships.append(relationship_index)
+            edge_indexes.append(data['index'])
+        edge_offsets.append(len(edge_targets))
+
+    contained_nodes = array(_UNSIGNED)
+    contained_offsets = array(_UNSIGNED, [0])
+    contained_targets = array(_UNSIGNED)
+    contained_edge_data = array(_FLAG)
+    for node_id in contained_graph.nodes_iter():
+        if (node_id not in node_indexes or
+                _node_instance(contained_graph, node_id) is not
+                graph.node[node_id]['node']):
+            raise SnapshotError(
+                "Contained graph node '{0}' is not the deployment graph "
+                "node".format(node_id))
+        contained_nodes.append(node_indexes[node_id])
+        for target_id, data in contained_graph.succ[node_id].iteritems():
+            has_data = bool(data)
+            if has_data and data != graph[node_id].get(target_id):
+                raise SnapshotError(
+                    'Unexpected data of contained edge {0} -> {1}: '
+                    '{2}'.format(node_id, target_id, data))
+            contained_targets.append(node_indexes[target_id])
+            contained_edge_data.append(has_data)
+        contained_offsets.append(len(contained_targets))
+
+    payload = [node_ids, node_instances, relationships]
+    try:
+        pickled_payload = cPickle.dumps(payload, _PICKLE_PROTOCOL)
+        # loading the payload back is the quickest way to make sure it
+        # holds nothing but storable values
+        _unpickle(pickled_payload)
+    except (cPickle.PicklingError, cPickle.UnpicklingError, TypeError):
+        raise SnapshotError(
+            'Unsupported value in deployment graph: {0!r}'.format(
+                _unsupported_value(payload)))
+    stream.write(_HEADER.pack(
+        _MAGIC, _VERSION,
+        len(pickled_payload),
+        len(node_ids), len(edge_targets),
+        len(contained_nodes), len(contained_targets)))
+    stream.write(pickled_payload)
+    for section in (edge_offsets, edge_targets, edge_relationships,
+                    edge_indexes, contained_nodes, contained_offsets,
+                    contained_targets, contained_edge_data):
+        if sys.byteorder != 'little':
+            section = array(section.typecode, section)
+            section.byteswap()
+        stream.write(section.tostring())
+
+
+def load_deployment_graphs(stream):
+    """
+    Read a snapshot written by dump_deployment_graphs
+    :param stream: a binary file like object, read up to its end
+    :return: a (deployment graph, contained graph) tuple, to be passed to
+        modify_deployment as previous_deployment_graphs
+    """
+    try:
+        return _without_gc(_load, stream)
+    except (ValueError, IndexError, KeyError, TypeError, AttributeError,
+            EOFError, struct.error, cPickle.UnpicklingError) as exc:
+        raise SnapshotError(
+            'Corrupt deployment graph snapshot: {0}'.format(exc))
+
+
+def _without_gc(func, *args):
+    # the graphs are made of many small containers and hardly anything but
+    # them is allocated while dumping or loading them, so garbage
+    # collection passes would only repeatedly (and needlessly) traverse them
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return func(*args)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _unpickle(data):
+    unpickler = cPickle.Unpickler(StringIO(data))
+    # only builtin containers and values are stored, so any class or
+    # function lookup is refused
+    unpickler.find_global = None
+    return unpickler.load()
+
+
+def _unsupported_value(value):
+    containers = set()
+    values = [value]
+    while values:
+        value = values.pop()
+        value_type = type(value)
+        if value_type not in _STORABLE_TYPES:
+            return value
+        if value_type is dict or value_type is list or value_type is tuple:
+            # containers shared or nested in themselves are checked once
+            if id(value) in containers:
+                continue
+            containers.add(id(value))
+            if value_type is dict:
+                values.extend(value.iterkeys())
+                values.extend(value.itervalues())
+            else:
+                values.extend(value)
+
+
+def _node_instance(graph, node_id):
+    data = graph.node[node_id]
+    if data.keys() != ['node']:
+        raise SnapshotError(
+            "Unexpected data of node '{0}': {1}".format(node_id, data))
+    return data['node']
+
+
+def _read(snapshot, size):
+    data = snapshot.read(size)
+    if len(data) != size:
+        raise SnapshotError(
+            'Corrupt deployment graph snapshot: expected {0} more bytes, '
+            'found {1}'.format(size, len(data)))
+    return data
+
+
+def _load(snapshot):
+    header = snapshot.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise SnapshotError('Not a deployment graph snapshot')
+    (magic, version, payload_length, nodes_num, edges_num,
+     contained_nodes_num, contained_edges_num) = _HEADER.unpack(header)
+    if magic != _MAGIC:
+        raise SnapshotError('Not a deployment graph snapshot')
+    if version != _VERSION:
+        raise SnapshotError(
+            'Unsupported deployment graph snapshot version {0}'.format(
+                version))
+    sections = [
+        (_UNSIGNED, nodes_num + 1),
+        (_UNSIGNED, edges_num),
+        (_SIGNED, edges_num),
+        (_SIGNED, edges_num),
+        (_UNSIGNED, contained_nodes_num),
+        (_UNSIGNED, contained_nodes_num + 1),
+        (_UNSIGNED, contained_edges_num),
+        (_FLAG, contained_edges_num),
+    ]
+    node_ids, node_instances, relationships = _unpickle(
+        _read(snapshot, payload_length))
+
+    def read_array(typecode, length):
+        result = array(typecode)
+        result.fromstring(_read(snapshot, result.itemsize * length))
+        if sys.byteorder != 'little':
+            result.byteswap()
+        return result
+
+    (edge_offsets, edge_targets, edge_relationships, edge_indexes,
+     contained_nodes, contained_offsets, contained_targets,
+     contained_edge_data) = [
+         read_array(typecode, length) for typecode, length in sections]
+    if snapshot.read(1):
+        raise SnapshotError(
+            'Corrupt deployment graph snapshot: unexpected data after its '
+            'end')
+
+    graph = networkx.DiGraph()
+    graph.graph[NODE_IDS] = node_ids
+    graph.add_nodes_from(
+        (node_id, {'node': node_instance})
+        for node_id, node_instance in zip(node_ids, node_instances))
+    edges = []
+    for source in xrange(nodes_num):
+        source_relationships = node_instances[source].get('relationships')
+        for edge in xrange(edge_offsets[source], edge_offsets[source + 1]):
+            relationship_index = edge_relationships[edge]
+            if relationship_index < 0:
+                relationship = relationships[~relationship_index]
+            else:
+                relationship = source_relationships[relationship_index]
+            edges.append((
+                node_ids[source], node_ids[edge_targets[edge]],
+                {'relationship': relationship, 'index': edge_indexes[edge]}))
+    graph.add_edges_from(edges)
+
+    contained_graph = networkx.DiGraph()
+    contained_graph.add_nodes_from(
+        (node_ids[index], {'node': node_instances[index]})
+        for index in contained_nodes)
+    contained_edges = []
+    for contained_index, source in enumerate(contained_nodes):
+        source_id = node_ids[source]
+        for edge in xrange(contained_offsets[contained_index],
+                           contained_offsets[contained_index + 1]):
+            target_id = node_ids[contained_targets[edge]]
+            if contained_edge_data[edge]:
+                data = graph[source_id][target_id]
+            else:
+                data = {}
+            contained_edges.append((source_id, target_id, data))
+    contained_graph.add_edges_from(contained_edges)
+    return graph, contained_graph
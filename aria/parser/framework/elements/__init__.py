@@ -125,11 +125,16 @@ class Element(object):  # pylint: disable=too-many-instance-attributes
 
     @property
     def value(self):
+        return copy.deepcopy(self.shared_value)
+
+    @property
+    def shared_value(self):
+        """The parsed value itself, not a copy: it must not be modified"""
         if self._parsed_value == UNPARSED:
             raise exceptions.DSLParsingSchemaAPIException(
                 exceptions.ERROR_CODE_ILLEGAL_VALUE_ACCESS,
                 'Cannot access element value before parsing')
-        return copy.deepcopy(self._parsed_value)
+        return self._parsed_value
 
     @value.setter
     def value(self, val):
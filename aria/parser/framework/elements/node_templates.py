@@ -106,9 +106,7 @@ def _relationship_type_predicate(source, target):
 def _node_template_related_nodes_predicate(source, target):
     if source.name == target.name:
         return False
-    targets = source.descendants(NodeTemplateRelationshipTarget)
-    relationship_targets = [e.initial_value for e in targets]
-    return target.name in relationship_targets
+    return target.name in source.relationship_targets()
 
 
 def _node_template_node_type_predicate(source, target):
@@ -119,6 +117,14 @@ def _node_template_node_type_predicate(source, target):
         return False
 
 
+def _sibling_node_type_predicate(source, target):
+    return _node_template_node_type_predicate(source.parent(), target)
+
+
+def _sibling_relationship_type_predicate(source, target):
+    return _relationship_type_predicate(source.parent(), target)
+
+
 def _post_process_node_relationships(
         processed_node,
         node_name_to_node,
@@ -198,7 +204,7 @@ def _process_node_relationships_operations(
 class NodeTemplateType(Element):
     required = True
     schema = Leaf(obj_type=str)
-    requires = {NodeTypes: [Value('node_types')]}
+    requires = {NodeTypes: [Value('node_types', shared=True)]}
 
     def validate(self, node_types, **kwargs):
         if self.initial_value not in node_types:
@@ -212,14 +218,15 @@ class NodeTemplateProperties(Element):
     schema = Leaf(obj_type=dict)
     requires = {
         NodeTemplateType: [],
-        NodeTypes: [Value('node_types')],
-        DataTypes: [Value('data_types')],
+        NodeType: [Value('node_type',
+                         predicate=_sibling_node_type_predicate,
+                         shared=True)],
+        DataTypes: [Value('data_types', shared=True)],
     }
 
-    def parse(self, node_types, data_types, **_):
+    def parse(self, node_type, data_types, **_):
         properties = self.initial_value or {}
         node_type_name = self.sibling(NodeTemplateType).value
-        node_type = node_types[node_type_name]
         return utils.merge_schema_and_instance_properties(
             instance_properties=properties,
             schema_properties=node_type['properties'],
@@ -238,7 +245,7 @@ class NodeTemplateProperties(Element):
 class NodeTemplateRelationshipType(Element):
     required = True
     schema = Leaf(obj_type=str)
-    requires = {Relationships: [Value('relationships')]}
+    requires = {Relationships: [Value('relationships', shared=True)]}
 
     def validate(self, relationships, **kwargs):
         if self.initial_value not in relationships:
@@ -256,7 +263,7 @@ class NodeTemplateRelationshipTarget(Element):
     def validate(self, **kwargs):
         relationship_type = self.sibling(NodeTemplateRelationshipType).name
         node_name = self.ancestor(NodeTemplate).name
-        node_template_names = self.ancestor(NodeTemplates).initial_value.keys()
+        node_template_names = self.ancestor(NodeTemplates).template_names()
         if self.initial_value not in node_template_names:
             raise DSLParsingLogicException(
                 25,
@@ -275,18 +282,20 @@ class NodeTemplateRelationshipProperties(Element):
     schema = Leaf(obj_type=dict)
     requires = {
         NodeTemplateRelationshipType: [],
-        Relationships: [Value('relationships')],
-        DataTypes: [Value('data_types')],
+        Relationship: [
+            Value('relationship_type',
+                  predicate=_sibling_relationship_type_predicate,
+                  shared=True)],
+        DataTypes: [Value('data_types', shared=True)],
     }
 
-    def parse(self, relationships, data_types, **_):
+    def parse(self, relationship_type, data_types, **_):
         relationship_type_name = self.sibling(
             NodeTemplateRelationshipType).value
         properties = self.initial_value or {}
         return utils.merge_schema_and_instance_properties(
             instance_properties=properties,
-            schema_properties=relationships[
-                relationship_type_name]['properties'],
+            schema_properties=relationship_type['properties'],
             data_types=data_types,
             undefined_error_message=(
                 "'{0}' node relationship '{1}' property is not part of "
@@ -320,7 +329,8 @@ class NodeTemplateRelationship(Element):
     requires = {
         Relationship: [
             Value('relationship_type',
-                  predicate=_relationship_type_predicate)],
+                  predicate=_relationship_type_predicate,
+                  shared=True)],
     }
 
     def parse(self, relationship_type, **_):
@@ -398,13 +408,30 @@ class NodeTemplate(Element):
         'inputs': [Requirement('resource_base', required=False)],
         'self': [Value('related_node_templates',
                        predicate=_node_template_related_nodes_predicate,
-                       multiple_results=True)],
+                       multiple_results=True,
+                       shared=True)],
         Plugins: [Value('plugins')],
         NodeType: [Value('node_type',
-                         predicate=_node_template_node_type_predicate)],
+                         predicate=_node_template_node_type_predicate,
+                         shared=True)],
         NodeTypes: ['host_types'],
     }
 
+    def __init__(self, *args, **kwargs):
+        super(NodeTemplate, self).__init__(*args, **kwargs)
+        self._relationship_targets = None
+
+    def relationship_targets(self):
+        """
+        The names of the node templates targeted by this node template's
+        relationships, gathered once for all the related nodes predicates
+        """
+        if self._relationship_targets is None:
+            self._relationship_targets = set(
+                e.initial_value
+                for e in self.descendants(NodeTemplateRelationshipTarget))
+        return self._relationship_targets
+
     def parse(self,
               node_type,
               host_types,
@@ -419,9 +446,15 @@ class NodeTemplate(Element):
             constants.TYPE_HIERARCHY: node_type[constants.TYPE_HIERARCHY]
         })
 
-        node[constants.INTERFACES] = merge_node_type_and_node_template_interfaces(
-            node_type_interfaces=node_type[constants.INTERFACES],
-            node_template_interfaces=node[constants.INTERFACES])
+        if node[constants.INTERFACES]:
+            node[constants.INTERFACES] = (
+                merge_node_type_and_node_template_interfaces(
+                    node_type_interfaces=node_type[constants.INTERFACES],
+                    node_template_interfaces=node[constants.INTERFACES]))
+        else:
+            node[constants.INTERFACES] = self.parent().type_interfaces(
+                node_type_name=node['type'],
+                node_type_interfaces=node_type[constants.INTERFACES])
 
         node['operations'] = _process_operations(
             partial_error_message="in node '{0}' of type '{1}'".format(
@@ -467,6 +500,33 @@ class NodeTemplates(Element):
         'deployment_plugins_to_install',
     ]
 
+    def __init__(self, *args, **kwargs):
+        super(NodeTemplates, self).__init__(*args, **kwargs)
+        self._template_names = None
+        self._type_interfaces = {}
+
+    def template_names(self):
+        """
+        The node template names, gathered once for all the relationship
+        targets validated against them
+        """
+        if self._template_names is None:
+            self._template_names = set(c.name for c in self.children())
+        return self._template_names
+
+    def type_interfaces(self, node_type_name, node_type_interfaces):
+        """
+        The node type interfaces merged with no node template overrides,
+        shared by all the node templates of the type that define no
+        interfaces
+        """
+        if node_type_name not in self._type_interfaces:
+            self._type_interfaces[node_type_name] = (
+                merge_node_type_and_node_template_interfaces(
+                    node_type_interfaces=node_type_interfaces,
+                    node_template_interfaces={}))
+        return self._type_interfaces[node_type_name]
+
     def parse(self, host_types, plugins, **_):
         processed_nodes = dict(
             (node.name, node.value) for node in self.children())
@@ -508,13 +568,22 @@ class NodeTemplates(Element):
                 nodes_operations[rel['target_id']].append(
                     rel['target_operations'])
 
+        # plugin records (a plugin with an executor) are shared by all the
+        # nodes using them, rather than copied per node
+        plugin_records = {}
         for node_name, node in processed_nodes.iteritems():
             node[constants.PLUGINS] = self._get_plugins_from_operations(
                 operations_lists=nodes_operations[node_name],
-                processed_plugins=plugins)
+                processed_plugins=plugins,
+                plugin_records=plugin_records)
+
+        hosted_nodes = defaultdict(list)
+        for node in processed_nodes.itervalues():
+            if 'host_id' in node:
+                hosted_nodes[node['host_id']].append(node)
 
         for node in processed_nodes.itervalues():
-            self._set_plugin_to_install(node, host_types, processed_nodes)
+            self._set_plugin_to_install(node, host_types, hosted_nodes)
             # set deployment_plugins_to_install property for nodes
             deployment_plugins_to_install = {}
             for plugin in node[constants.PLUGINS]:
@@ -526,18 +595,17 @@ class NodeTemplates(Element):
 
         self._validate_agent_plugins(processed_nodes)
 
-    def _set_plugin_to_install(self, node, host_types, processed_nodes):
+    def _set_plugin_to_install(self, node, host_types, hosted_nodes):
         if node['type'] in host_types:
             plugins_to_install = {}
-            for another_node in processed_nodes.itervalues():
-                # going over all other nodes, to accumulate plugins
-                # from different nodes whose host is the current node
-                if another_node.get('host_id') == node['id']:
-                    # ok to override here since we assume it is
-                    # the same plugin
-                    for plugin in another_node[constants.PLUGINS]:
-                        if self.should_install_plugin(plugin):
-                            plugins_to_install[plugin['name']] = plugin
+            # going over the nodes whose host is the current node, to
+            # accumulate their plugins
+            for hosted_node in hosted_nodes[node['id']]:
+                # ok to override here since we assume it is
+                # the same plugin
+                for plugin in hosted_node[constants.PLUGINS]:
+                    if self.should_install_plugin(plugin):
+                        plugins_to_install[plugin['name']] = plugin
             node[constants.PLUGINS_TO_INSTALL] = plugins_to_install.values()
 
     def _validate_agent_plugins(self, processed_nodes):
@@ -558,19 +626,22 @@ class NodeTemplates(Element):
                                 plugin['name'],
                                 constants.HOST_AGENT))
 
-    def _get_plugins_from_operations(self, operations_lists, processed_plugins):
+    def _get_plugins_from_operations(
+            self, operations_lists, processed_plugins, plugin_records):
         plugins = {}
         for operations in operations_lists:
             for operation in operations.values():
                 plugin_name = operation['plugin']
                 if not plugin_name:
                     continue
-                plugin = processed_plugins[plugin_name]
                 operation_executor = operation['executor']
                 plugin_key = (plugin_name, operation_executor)
                 if plugin_key in plugins:
                     continue
-                plugin = copy.deepcopy(plugin)
-                plugin['executor'] = operation_executor
+                plugin = plugin_records.get(plugin_key)
+                if plugin is None:
+                    plugin = copy.deepcopy(processed_plugins[plugin_name])
+                    plugin['executor'] = operation_executor
+                    plugin_records[plugin_key] = plugin
                 plugins[plugin_key] = plugin
         return plugins.values()
@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from itertools import product
+from collections import defaultdict
 
 import networkx
 
@@ -194,7 +194,16 @@ class Policies(DictElement):
 
     def _validate_no_group_cycles(self, member_graph):
         # verify no group cycles (i.e. group A in group B and vice versa)
-        group_cycles = networkx.recursive_simple_cycles(member_graph)
+        # cycles only lie within strongly connected components, so these
+        # (being linear to find) narrow the costly cycles search
+        cyclic_members = [
+            member
+            for component in networkx.strongly_connected_components(
+                member_graph)
+            for member in component
+            if len(component) > 1 or member_graph.has_edge(member, member)]
+        group_cycles = cyclic_members and networkx.recursive_simple_cycles(
+            member_graph.subgraph(cyclic_members))
         if group_cycles:
             raise DSLParsingLogicException(
                 ERROR_GROUP_CYCLE,
@@ -217,82 +226,41 @@ class Policies(DictElement):
         # nodes that are not (recursively) contained in node b too unless
         # node b is in that group as well
 
-        # first extract all group members (recursively)
-        group_members = dict(
-            (member, networkx.ancestors(member_graph, member))
-            for member in member_graph
-            if member not in node_graph
-        )
-
-        group_names = set(group_members.keys())
-        group_node_members = dict(
-            (group_name, members - group_names)
-            for group_name, members in group_members.iteritems()
-        )
-
-        # now, for each group, for each node pair, verify both nodes in pair
-        # are contained (recursively) in some third node or one of them is
-        # contained in some third node that has this property
-        containing_nodes = {}
-
-        def check_pair(pair_key):
-            node_a, node_b = pair_key
-            if node_a == node_b:
-                return True
-            if node_a not in containing_nodes:
-                containing_nodes[node_a] = networkx.topological_sort(
-                    node_graph, nbunch=[node_a])
-            if node_b not in containing_nodes:
-                containing_nodes[node_b] = networkx.topological_sort(
-                    node_graph, nbunch=[node_b])
-
-            a_containing_nodes = set(containing_nodes[node_a])
-            a_containing_nodes.remove(node_a)
-            b_containing_nodes = set(containing_nodes[node_b])
-            b_containing_nodes.remove(node_b)
-
-            if not (a_containing_nodes or b_containing_nodes):
-                return True
-            if node_b in a_containing_nodes:
-                return True
-            if node_a in b_containing_nodes:
-                return True
-            return a_containing_nodes & b_containing_nodes
-
-        checked_pairs = set()
-        ok_pairs = set()
-        problematic_pairs = set()
-        for node_members in group_node_members.values():
-            for node_a, node_b in product(node_members, repeat=2):
-                pair_key = tuple(sorted([node_a, node_b]))
-                if pair_key in checked_pairs:
+        # every group is checked against its (recursive) node members: a
+        # node member is walked up its chain of groups once, and is added
+        # to each of them
+        group_chains = {}
+        group_node_members = defaultdict(set)
+        for member in member_graph:
+            if member in node_graph:
+                for group in _ancestry(member_graph, member, group_chains)[1:]:
+                    group_node_members[group].add(member)
+
+        # two such nodes are fine if they are contained in the same root
+        # node, or if both root nodes are members of the group too, in which
+        # case either node is contained in a node that is fine with the
+        # other one
+        node_chains = {}
+        for _, node_members in sorted(group_node_members.iteritems()):
+            root_nodes = defaultdict(list)
+            for member in sorted(node_members):
+                root_node = _ancestry(node_graph, member, node_chains)[-1]
+                root_nodes[root_node].append(member)
+            if len(root_nodes) < 2:
+                continue
+            for root_node in sorted(root_nodes):
+                if root_node in node_members:
                     continue
-                if check_pair(pair_key):
-                    ok_pairs.add(pair_key)
-                else:
-                    problematic_pairs.add(pair_key)
-                checked_pairs.add(pair_key)
-
-        def check_problematic_pair(node_a, node_b):
-            for node_a_containing_node in containing_nodes[node_a]:
-                pair_key = tuple(sorted([node_b, node_a_containing_node]))
-                if pair_key in ok_pairs:
-                    return True
-            for node_b_containing_node in containing_nodes[node_b]:
-                pair_key = tuple(sorted([node_a, node_b_containing_node]))
-                if pair_key in ok_pairs:
-                    return True
-            return False
-
-        for node_a, node_b in problematic_pairs:
-            if check_problematic_pair(node_a, node_b):
-                ok_pairs.add((node_a, node_b))
-            else:
+                node_a = root_nodes[root_node][0]
+                node_b = next(
+                    members[0] for other_root_node, members in
+                    sorted(root_nodes.iteritems())
+                    if other_root_node != root_node)
                 raise DSLParsingLogicException(
                     ERROR_NON_CONTAINED_GROUP_MEMBERS,
                     "Node '{0}' and '{1}' belong to some shared group but "
                     "they are not contained in any shared node, nor is any "
-                    "ancestor node of theirs.")
+                    "ancestor node of theirs.".format(node_a, node_b))
 
     def _remove_contained_nodes(self, scaling_groups, member_graph, node_graph):
         # for each node, if a node is (recursively) with
@@ -301,40 +269,59 @@ class Policies(DictElement):
         # if the node and its containee are in the same group, remove the
         # containee, otherwise, remove the group closest to the containing
         # node
+        group_chains = {}
+        node_chains = {}
+        removed_members = defaultdict(set)
         for member in member_graph:
             if member not in node_graph:
                 continue
-            containing_groups = networkx.topological_sort(
-                member_graph, nbunch=[member])
-            containing_nodes = networkx.topological_sort(
-                node_graph, nbunch=[member])
-
-            for node in containing_nodes:
-                if node == member or node not in member_graph:
-                    continue
-
-                containing_node_groups = networkx.topological_sort(
-                    member_graph, nbunch=[node])
-                containing_node_groups_set = set(containing_node_groups)
+            # the member followed by its groups, innermost first
+            containing_groups = _ancestry(member_graph, member, group_chains)
+            containing_nodes = _ancestry(node_graph, member, node_chains)
 
-                shared_groups = (
-                    set(containing_groups) & containing_node_groups_set)
-                if not shared_groups:
+            for node in containing_nodes[1:]:
+                if node not in member_graph:
                     continue
-
-                minimal_containing_group = networkx.topological_sort(
-                    member_graph, nbunch=shared_groups)[0]
-                direct_member_group = member_graph.successors(member)[0]
-                members = scaling_groups[minimal_containing_group]['members']
-                if direct_member_group == minimal_containing_group:
-                    removed_member = member
-                else:
-                    for containing_group in reversed(containing_groups):
-                        if containing_group not in containing_node_groups_set:
-                            removed_member = containing_group
-                            break
-                    else:
-                        raise RuntimeError('Illegal state')
-
-                if removed_member in members:
-                    members.remove(removed_member)
+                containing_node_groups_set = set(
+                    _ancestry(member_graph, node, group_chains))
+
+                # the groups shared with the containing node are the outer
+                # part of containing_groups, the first one being the
+                # minimal containing group. what is right below it is
+                # removed from it: the member itself if it is a direct
+                # member, otherwise the group closest to the containing node
+                for index, group in enumerate(containing_groups):
+                    if group in containing_node_groups_set:
+                        removed_members[group].add(
+                            containing_groups[index - 1])
+                        break
+
+        for group_name, removed in removed_members.iteritems():
+            members = scaling_groups[group_name]['members']
+            members[:] = [
+                member for member in members if member not in removed]
+
+
+def _ancestry(graph, node, chains):
+    """
+    The node followed by its ancestors, nearest first, in a graph where no
+    node has more than one successor (a member's group, or a node's
+    container). The chains are memoized in chains, so that each node is
+    walked once.
+    """
+    walked = []
+    walked_set = set()
+    while node not in chains:
+        walked.append(node)
+        walked_set.add(node)
+        successors = graph.succ[node]
+        node = next(iter(successors), None) if successors else None
+        if node is None or node in walked_set:
+            chain = ()
+            break
+    else:
+        chain = chains[node]
+    for walked_node in reversed(walked):
+        chain = (walked_node,) + chain
+        chains[walked_node] = chain
+    return chain
@@ -14,7 +14,10 @@
 # limitations under the License.
 
 import abc
+import copy
+import time
 from functools import partial
+from collections import OrderedDict
 
 from .. import scan
 from ..constants import FUNCTION_NAME_PATH_SEPARATOR
@@ -23,11 +26,17 @@ from ..exceptions import UnknownInputError, FunctionEvaluationError
 
 def _get_relationships_type():
     # TODO: ugly huck for now..., sort the imports when you have time
-    from .elements.relationships import RelationshipMapping
-    return RelationshipMapping().contained_in_relationship_type
+    global _contained_in_relationship_type  # pylint: disable=global-statement,invalid-name
+    if _contained_in_relationship_type is None:
+        from .elements.relationships import RelationshipMapping
+        _contained_in_relationship_type = (
+            RelationshipMapping().contained_in_relationship_type)
+    return _contained_in_relationship_type
 
 
 SELF, SOURCE, TARGET = 'SELF', 'SOURCE', 'TARGET'
+_MISSING = object()
+_contained_in_relationship_type = None  # pylint: disable=invalid-name
 _template_functions = {}  #  pylint: disable=invalid-name
 
 
@@ -43,41 +52,215 @@ def unregister(name):
     _template_functions.pop(name, None)
 
 
+class _ExpiringCache(object):
+    """
+    A bounded mapping whose entries expire ``ttl`` seconds after they were
+    stored. When ``max_size`` is exceeded the least recently used entries are
+    evicted.
+    """
+    def __init__(self, ttl=None, max_size=None, clock=time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self._clock():
+            return default
+        self._entries[key] = entry
+        return value
+
+    def set(self, key, value, expires_at=_MISSING):
+        if expires_at is _MISSING:
+            expires_at = (
+                None if self.ttl is None else self._clock() + self.ttl)
+        self._entries.pop(key, None)
+        self._entries[key] = (value, expires_at)
+        if self.max_size is not None:
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        value, _ = self._entries.pop(key, (default, None))
+        return value
+
+    def expires_at(self, key):
+        """
+        When the entry of ``key`` expires: None if never, and now if there is
+        no such entry.
+        """
+        entry = self._entries.get(key)
+        return self._clock() if entry is None else entry[1]
+
+    def clear(self):
+        self._entries.clear()
+
+
+def _earliest(expiries):
+    expiries = [expires_at for expires_at in expiries if expires_at is not None]
+    return min(expiries) if expiries else None
+
+
 class RuntimeEvaluationStorage(object):
+    """
+    Caches nodes and node instances fetched during runtime evaluation.
+
+    A storage may be shared between several ``evaluate_functions`` and
+    ``evaluate_outputs`` calls (see their ``storage`` argument) so lookups
+    against the same deployment are reused. ``ttl`` (seconds) and
+    ``max_size`` (entries per cached table) bound how stale and how big the
+    cache may get, and the ``invalidate_*`` methods should be called whenever
+    the underlying data changes (e.g. on runtime properties update).
+    """
     def __init__(
             self,
             get_node_instances_method,
             get_node_instance_method,
-            get_node_method):
+            get_node_method,
+            ttl=None,
+            max_size=None,
+            clock=time.time):
         self._get_node_instances_method = get_node_instances_method
         self._get_node_instance_method = get_node_instance_method
         self._get_node_method = get_node_method
 
-        self._node_to_node_instances = {}
-        self._node_instances = {}
-        self._nodes = {}
+        self._node_to_node_instances = _ExpiringCache(ttl, max_size, clock)
+        self._node_instances = _ExpiringCache(ttl, max_size, clock)
+        self._nodes = _ExpiringCache(ttl, max_size, clock)
+
+        # indexes derived from the cached nodes and node instances, which
+        # expire together with the earliest entry they were derived from
+        self._containment = _ExpiringCache(ttl, max_size, clock)
+        self._group_instances = _ExpiringCache(ttl, max_size, clock)
 
     def get_node_instances(self, node_id):
-        if node_id in self._node_to_node_instances:
-            return self._node_to_node_instances[node_id]
+        node_instances = self._node_to_node_instances.get(node_id, _MISSING)
+        if node_instances is not _MISSING:
+            return node_instances
 
         node_instances = self._get_node_instances_method(node_id)
-        self._node_to_node_instances[node_id] = node_instances
+        self._node_to_node_instances.set(node_id, node_instances)
         for node_instance in node_instances:
-            self._node_instances[node_instance.id] = node_instance
-        return self._node_to_node_instances[node_id]
+            self._node_instances.set(node_instance.id, node_instance)
+        return node_instances
 
     def get_node_instance(self, node_instance_id):
-        if node_instance_id not in self._node_instances:
+        node_instance = self._node_instances.get(node_instance_id, _MISSING)
+        if node_instance is _MISSING:
             node_instance = self._get_node_instance_method(node_instance_id)
-            self._node_instances[node_instance_id] = node_instance
-        return self._node_instances[node_instance_id]
+            self._node_instances.set(node_instance_id, node_instance)
+        return node_instance
 
     def get_node(self, node_id):
-        if node_id not in self._nodes:
+        node = self._nodes.get(node_id, _MISSING)
+        if node is _MISSING:
             node = self._get_node_method(node_id)
-            self._nodes[node_id] = node
-        return self._nodes[node_id]
+            self._nodes.set(node_id, node)
+        return node
+
+    def get_containment(self, node_instance):
+        """
+        List the scaling groups containing a node instance, either directly
+        or through its contained_in ancestors, innermost first.
+
+        :return: list of (group name, group instance id) tuples.
+        """
+        containment = self._containment.get(node_instance.id)
+        if containment is None:
+            containment = [
+                (group['name'], group['id'])
+                for group in node_instance.scaling_groups or ()]
+            parent_instance = self._parent_instance(node_instance)
+            expiries = [
+                self._node_instances.expires_at(node_instance.id),
+                self._nodes.expires_at(node_instance.node_id)]
+            if parent_instance:
+                containment += self.get_containment(parent_instance)
+                expiries.append(
+                    self._containment.expires_at(parent_instance.id))
+            self._containment.set(
+                node_instance.id, containment, _earliest(expiries))
+        return containment
+
+    def get_group_instance_id(self, node_instance, group_name):
+        for name, group_instance_id in self.get_containment(node_instance):
+            if name == group_name:
+                return group_instance_id
+        raise RuntimeError('Illegal state')
+
+    def get_node_instances_by_group(self, node_id, group_name):
+        """
+        Index the instances of a node by the instance of ``group_name``
+        containing them.
+
+        :return: dict of group instance id to list of node instances.
+        """
+        key = (node_id, group_name)
+        group_instances = self._group_instances.get(key)
+        if group_instances is None:
+            group_instances = {}
+            node_instances = self.get_node_instances(node_id)
+            expiries = [self._node_to_node_instances.expires_at(node_id)]
+            for node_instance in node_instances:
+                group_instance_id = self.get_group_instance_id(
+                    node_instance, group_name)
+                group_instances.setdefault(
+                    group_instance_id, []).append(node_instance)
+                expiries.append(
+                    self._containment.expires_at(node_instance.id))
+            self._group_instances.set(
+                key, group_instances, _earliest(expiries))
+        return group_instances
+
+    def _parent_instance(self, node_instance):
+        node = self.get_node(node_instance.node_id)
+        contained_in_type = _get_relationships_type()
+        for relationship in node.relationships or ():
+            if contained_in_type not in relationship['type_hierarchy']:
+                continue
+            target_name = relationship['target_id']
+            target_id = [
+                r['target_id'] for r in node_instance.relationships
+                if r['target_name'] == target_name][0]
+            return self.get_node_instance(target_id)
+        return None
+
+    def invalidate_node_instance(self, node_instance_id):
+        """
+        Drop a cached node instance, together with the cached instances list
+        of its node (which holds the same, now stale, instance).
+        """
+        node_instance = self._node_instances.pop(node_instance_id)
+        if node_instance is not None:
+            self._node_to_node_instances.pop(node_instance.node_id)
+        self._clear_indexes()
+
+    def invalidate_node(self, node_id):
+        """
+        Drop a cached node and all of its cached node instances.
+        """
+        self._nodes.pop(node_id)
+        for node_instance in self._node_to_node_instances.pop(node_id) or ():
+            self._node_instances.pop(node_instance.id)
+        self._clear_indexes()
+
+    def clear(self):
+        self._node_to_node_instances.clear()
+        self._node_instances.clear()
+        self._nodes.clear()
+        self._clear_indexes()
+
+    def _clear_indexes(self):
+        self._containment.clear()
+        self._group_instances.clear()
 
 
 class Function(object):
@@ -92,6 +275,15 @@ class Function(object):
         self.raw = raw
         self.parse_args(args)
 
+    def bind(self, context):
+        """
+        A copy of this function evaluated in ``context``; the function itself
+        is left as is, so it may be bound to several contexts at once.
+        """
+        bound = copy.copy(self)
+        bound.context = context
+        return bound
+
     @abc.abstractmethod
     def parse_args(self, args):
         pass
@@ -328,45 +520,15 @@ class GetAttribute(Function):
 
     def _resolve_node_by_scaling_group(self, storage, node_instances):
 
-        def _parent_instance(_instance):
-            _node = storage.get_node(_instance.node_id)
-            for relationship in _node.relationships or ():
-                if (_get_relationships_type()
-                        not in relationship['type_hierarchy']):
-                    continue
-                target_name = relationship['target_id']
-                target_id = [
-                    r['target_id'] for r in _instance.relationships
-                    if r['target_name'] == target_name][0]
-                return storage.get_node_instance(target_id)
-            return None
-
-        def _containing_groups(_instance):
-            result = [g['name'] for g in _instance.scaling_groups or ()]
-            parent_instance = _parent_instance(_instance)
-            if parent_instance:
-                result += _containing_groups(parent_instance)
-            return result
-
         def _minimal_shared_group(instance_a, instance_b):
-            a_containing_groups = _containing_groups(instance_a)
-            b_containing_groups = _containing_groups(instance_b)
-            shared_groups = set(a_containing_groups) & set(b_containing_groups)
-            if not shared_groups:
-                return None
+            a_containing_groups = [
+                name for name, _ in storage.get_containment(instance_a)]
+            b_containing_groups = set(
+                name for name, _ in storage.get_containment(instance_b))
             for group in a_containing_groups:
-                if group in shared_groups:
+                if group in b_containing_groups:
                     return group
-            raise RuntimeError('Illegal state')
-
-        def _group_instance(node_instance, group_name):
-            for scaling_group in node_instance.scaling_groups or ():
-                if scaling_group['name'] == group_name:
-                    return scaling_group['id']
-            parent_instance = _parent_instance(node_instance)
-            if not parent_instance:
-                raise RuntimeError('Illegal state')
-            return _group_instance(parent_instance, group_name)
+            return None
 
         def _resolve_node_instance(context_instance_id):
             context_instance = storage.get_node_instance(context_instance_id)
@@ -374,11 +536,11 @@ class GetAttribute(Function):
                 context_instance, node_instances[0])
             if not minimal_shared_group:
                 return None
-            context_group_instance = _group_instance(
+            context_group_instance = storage.get_group_instance_id(
                 context_instance, minimal_shared_group)
-            result_node_instances = [
-                i for i in node_instances
-                if _group_instance(i, minimal_shared_group) == context_group_instance]
+            result_node_instances = storage.get_node_instances_by_group(
+                self.node_name, minimal_shared_group).get(
+                    context_group_instance, ())
             if len(result_node_instances) == 1:
                 return result_node_instances[0]
             return None
@@ -430,7 +592,7 @@ class Concat(Function):
 
     def evaluate(self, plan):
         for joined_value in self.joined:
-            if parse(joined_value) != joined_value:
+            if is_function(joined_value):
                 return self.raw
         return self.join()
 
@@ -442,24 +604,39 @@ class Concat(Function):
         return self.separator.join(str_join)
 
 
+def is_function(value):
+    """Check whether a raw value is an intrinsic function, without parsing it.
+    """
+    return (isinstance(value, dict) and
+            len(value) == 1 and
+            next(value.iterkeys()) in _template_functions)
+
+
 def parse(raw_function, scope=None, context=None, path=None):
-    if isinstance(raw_function, dict) and len(raw_function) == 1:
-        func_name = raw_function.keys()[0]
-        if func_name in _template_functions:
-            func_args = raw_function.values()[0]
-            return _template_functions[func_name](
-                func_args,
-                scope=scope,
-                context=context,
-                path=path,
-                raw=raw_function)
-    return raw_function
+    """Parse a raw value into a Function object (if it is a function).
+
+    :param raw_function: The raw value.
+    :param scope: Scope the function appears in.
+    :param context: Context the function appears in.
+    :param path: Path of the function (for logging).
+    :return: a Function object, or raw_function itself if it isn't one.
+    """
+    if not is_function(raw_function):
+        return raw_function
+    func_name, func_args = next(raw_function.iteritems())
+    return _template_functions[func_name](
+        func_args,
+        scope=scope,
+        context=context,
+        path=path,
+        raw=raw_function)
 
 
 def evaluate_functions(payload, context,
-                       get_node_instances_method,
-                       get_node_instance_method,
-                       get_node_method):
+                       get_node_instances_method=None,
+                       get_node_instance_method=None,
+                       get_node_method=None,
+                       storage=None):
     """Evaluate functions in payload.
 
     :param payload: The payload to evaluate.
@@ -467,11 +644,14 @@ def evaluate_functions(payload, context,
     :param get_node_instances_method: A method for getting node instances.
     :param get_node_instance_method: A method for getting a node instance.
     :param get_node_method: A method for getting a node.
+    :param storage: A (possibly shared) RuntimeEvaluationStorage to use
+                    instead of creating one from the get methods.
     :return: payload.
     """
     handler = runtime_evaluation_handler(get_node_instances_method,
                                          get_node_instance_method,
-                                         get_node_method)
+                                         get_node_method,
+                                         storage=storage)
     scan.scan_properties(payload,
                          handler,
                          scope=None,
@@ -482,15 +662,18 @@ def evaluate_functions(payload, context,
 
 
 def evaluate_outputs(outputs_def,
-                     get_node_instances_method,
-                     get_node_instance_method,
-                     get_node_method):
+                     get_node_instances_method=None,
+                     get_node_instance_method=None,
+                     get_node_method=None,
+                     storage=None):
     """Evaluates an outputs definition containing intrinsic functions.
 
     :param outputs_def: Outputs definition.
     :param get_node_instances_method: A method for getting node instances.
     :param get_node_instance_method: A method for getting a node instance.
     :param get_node_method: A method for getting a node.
+    :param storage: A (possibly shared) RuntimeEvaluationStorage to use
+                    instead of creating one from the get methods.
     :return: Outputs dict.
     """
     outputs = dict((k, v['value']) for k, v in outputs_def.iteritems())
@@ -499,7 +682,37 @@ def evaluate_outputs(outputs_def,
         context={},
         get_node_instances_method=get_node_instances_method,
         get_node_instance_method=get_node_instance_method,
-        get_node_method=get_node_method)
+        get_node_method=get_node_method,
+        storage=storage)
+
+
+def evaluate_functions_bulk(payload, contexts,
+                            get_node_instances_method=None,
+                            get_node_instance_method=None,
+                            get_node_method=None,
+                            storage=None):
+    """Evaluate functions in a payload template once per context.
+
+    Useful for evaluating the same operation inputs for many node
+    instances: the template is parsed once and all evaluations share a
+    single storage. Unlike evaluate_functions, the payload is left untouched
+    and a new evaluated payload is created for each context.
+
+    :param payload: The payload template to evaluate.
+    :param contexts: An iterable of contexts to evaluate the payload with.
+    :param get_node_instances_method: A method for getting node instances.
+    :param get_node_instance_method: A method for getting a node instance.
+    :param get_node_method: A method for getting a node.
+    :param storage: A (possibly shared) RuntimeEvaluationStorage to use
+                    instead of creating one from the get methods.
+    :return: list of evaluated payloads, ordered as contexts.
+    """
+    handler = runtime_evaluation_handler(get_node_instances_method,
+                                         get_node_instance_method,
+                                         get_node_method,
+                                         storage=storage)
+    build = _compile_payload(payload, 'payload')
+    return [build(context, handler) for context in contexts]
 
 
 def plan_evaluation_handler(plan):
@@ -508,12 +721,14 @@ def plan_evaluation_handler(plan):
 
 def runtime_evaluation_handler(get_node_instances_method,
                                get_node_instance_method,
-                               get_node_method):
-    return _handler('evaluate_runtime',
-                    storage=RuntimeEvaluationStorage(
-                        get_node_instances_method=get_node_instances_method,
-                        get_node_instance_method=get_node_instance_method,
-                        get_node_method=get_node_method))
+                               get_node_method,
+                               storage=None):
+    if storage is None:
+        storage = RuntimeEvaluationStorage(
+            get_node_instances_method=get_node_instances_method,
+            get_node_instance_method=get_node_instance_method,
+            get_node_method=get_node_method)
+    return _handler('evaluate_runtime', storage=storage)
 
 
 def validate_functions(plan):
@@ -637,27 +852,112 @@ def _get_property_value(
 
 
 def _handler(evaluator, **evaluator_kwargs):
+    """
+    Create a scan handler evaluating intrinsic functions bottom-up: the
+    arguments of a function are evaluated (and replaced in place) before the
+    function itself, so every node of a nested function expression is
+    evaluated once per scan pass. Functions which cannot be evaluated yet
+    (i.e. evaluate to their own raw definition) are remembered, so scanning
+    into them again later in the same pass is a no-op.
+    """
+    unresolved_functions = {}
+
     def handler(evaluated_value, scope, context, path):
-        scanned = False
-        while True:
-            func = parse(
-                evaluated_value,
-                scope=scope,
-                context=context,
-                path=path)
-            if not isinstance(func, Function):
-                break
-            previous_evaluated_value = evaluated_value
-            evaluated_value = getattr(func, evaluator)(**evaluator_kwargs)
-            if scanned and previous_evaluated_value == evaluated_value:
-                break
-            scan.scan_properties(
-                evaluated_value,
-                handler,
-                scope=scope,
-                context=context,
-                path=path,
-                replace=True)
-            scanned = True
-        return evaluated_value
+        if not is_function(evaluated_value):
+            return evaluated_value
+        if (id(evaluated_value), scope, id(context)) in unresolved_functions:
+            return evaluated_value
+        func_name, func_args = next(evaluated_value.iteritems())
+        evaluated_args = evaluate_value(func_args, scope, context, path)
+        if evaluated_args is not func_args:
+            evaluated_value[func_name] = evaluated_args
+        func = parse(
+            evaluated_value,
+            scope=scope,
+            context=context,
+            path=path)
+        return evaluate(func, evaluated_value, scope, context, path)
+
+    def evaluate(func, evaluated_value, scope, context, path):
+        result = getattr(func, evaluator)(**evaluator_kwargs)
+        if result is evaluated_value or (
+                is_function(result) and result == evaluated_value):
+            # keeping the raw dict and context alive makes sure their ids
+            # are not reused
+            unresolved_functions[
+                (id(evaluated_value), scope, id(context))] = (
+                    evaluated_value, context)
+            return result
+        return evaluate_value(result, scope, context, path)
+
+    def evaluate_value(value, scope, context, path):
+        if isinstance(value, dict):
+            if is_function(value):
+                return handler(value, scope, context, path)
+            items = [('{0}.{1}'.format(path, key), key, item)
+                     for key, item in value.iteritems()]
+        elif isinstance(value, list):
+            items = [('{0}[{1}]'.format(path, index), index, item)
+                     for index, item in enumerate(value)]
+        else:
+            return value
+        for item_path, key, item in items:
+            result = evaluate_value(item, scope, context, item_path)
+            if result is not item:
+                value[key] = result
+        return value
+
+    # exposed so already parsed functions can be evaluated directly
+    handler.evaluate = evaluate
     return handler
+
+
+def _contains_functions(value):
+    if is_function(value):
+        return True
+    if isinstance(value, dict):
+        return any(_contains_functions(item) for item in value.itervalues())
+    if isinstance(value, list):
+        return any(_contains_functions(item) for item in value)
+    return False
+
+
+def _compile_payload(value, path):
+    """
+    Compile a payload template into a builder, a callable accepting
+    (context, handler) and returning an evaluated copy of the template.
+
+    Function objects are parsed once, here. A function whose arguments hold
+    no nested functions is re-evaluated as is for every context; any other
+    function is evaluated on a fresh copy of its raw definition, since its
+    evaluation may replace values within it.
+    """
+    func = parse(value, path=path)
+    if isinstance(func, Function):
+        if _contains_functions(func.raw.values()[0]):
+            return lambda context, handler: handler(
+                copy.deepcopy(func.raw), None, context, path)
+
+        def build_function(context, handler):
+            result = handler.evaluate(
+                func.bind(context), func.raw, None, context, path)
+            return copy.deepcopy(result) if result is func.raw else result
+        return build_function
+
+    if not _contains_functions(value):
+        if isinstance(value, (dict, list)):
+            return lambda context, handler: copy.deepcopy(value)
+        return lambda context, handler: value
+
+    if isinstance(value, dict):
+        builders = [
+            (key, _compile_payload(item, '{0}.{1}'.format(path, key)))
+            for key, item in value.iteritems()]
+        return lambda context, handler: dict(
+            (key, build(context, handler)) for key, build in builders)
+
+    builders = [
+        _compile_payload(item, '{0}[{1}]'.format(path, index))
+        for index, item in enumerate(value)]
+    return lambda context, handler: [
+        build(context, handler) for build in builders]
@@ -394,9 +394,12 @@ def _search_for_requirements(
         if requirement.predicate and not requirement.predicate(element, required_element):
             continue
         if requirement.parsed:
-            result.append(required_element.value)
+            result.append(
+                required_element.shared_value if requirement.shared
+                else required_element.value)
             continue
-        if requirement.name not in required_element.provided:
+        provided = required_element.provided
+        if requirement.name not in provided:
             if not requirement.required:
                 continue
             raise DSLParsingFormatException(
@@ -406,8 +409,8 @@ def _search_for_requirements(
                 "are: {2}".format(
                     requirement.name,
                     required_element.name,
-                    required_element.provided.keys()))
-        result.append(required_element.provided[requirement.name])
+                    provided.keys()))
+        result.append(provided[requirement.name])
 
 
 def _sort_requirements_result(result, requirement):
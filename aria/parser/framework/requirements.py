@@ -20,19 +20,24 @@ class Requirement(object):  # pylint: disable=too-few-public-methods
                  parsed=False,
                  multiple_results=False,
                  required=True,
-                 predicate=None):
+                 predicate=None,
+                 shared=False):
         self.name = name
         self.parsed = parsed
         self.multiple_results = multiple_results
         self.required = required
         self.predicate = predicate
+        # parsed values are passed as they are rather than deep copied,
+        # for requiring elements that only read them
+        self.shared = shared
 
     def __repr__(self):
         return (
             '{cls.__name__}('
             'name={self.name}, parsed={self.parsed}, '
             'multiple_results={self.multiple_results}, '
-            'required={self.required}, predicate={self.predicate})'
+            'required={self.required}, predicate={self.predicate}, '
+            'shared={self.shared})'
             .format(cls=self.__class__, self=self))
 
 
@@ -41,13 +46,15 @@ class Value(Requirement):  # pylint: disable=too-few-public-methods
                  name,
                  multiple_results=False,
                  required=True,
-                 predicate=None):
+                 predicate=None,
+                 shared=False):
         super(Value, self).__init__(
             name,
             parsed=True,
             multiple_results=multiple_results,
             required=required,
-            predicate=predicate)
+            predicate=predicate,
+            shared=shared)
 
 
 def sibling_predicate(source, target):
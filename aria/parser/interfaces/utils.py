@@ -110,7 +110,7 @@ def _validate_inputs_types(inputs, schema_inputs):
             continue
         input_val = inputs[input_key]
 
-        if functions.parse(input_val) != input_val:
+        if functions.is_function(input_val):
             # intrinsic function - not validated at the moment
             continue
 
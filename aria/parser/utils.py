@@ -13,11 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import copy
 import importlib
 import sys
 
-from .framework.functions import parse
+from .framework.functions import is_function
 from .constants import (
     RESOLVER_IMPLEMENTATION_KEY,
     RESLOVER_PARAMETERS_KEY,
@@ -30,6 +29,16 @@ from .exceptions import (
 )
 from .import_resolver import DefaultImportResolver
 
+# the primitive property types and whether a value is valid for each
+_PRIMITIVE_TYPE_CHECKS = {
+    'integer': lambda value: (isinstance(value, (int, long)) and
+                              not isinstance(value, bool)),
+    'float': lambda value: (isinstance(value, (int, float, long)) and
+                            not isinstance(value, bool)),
+    'boolean': lambda value: isinstance(value, bool),
+    'string': lambda value: True,
+}
+
 
 def merge_schemas(overridden_schema, overriding_schema, data_types):
     merged = overriding_schema.copy()
@@ -104,21 +113,13 @@ def parse_value(
         raise_on_missing_property=True):
     if type_name is None:
         return value
-    if parse(value) != value:
+    if is_function(value):
         # intrinsic function - not validated at the moment
         return value
-    if type_name == 'integer':
-        if isinstance(value, (int, long)) and not isinstance(value, bool):
-            return value
-    elif type_name == 'float':
-        if all((isinstance(value, (int, float, long)),
-                not isinstance(value, bool))):
+    type_check = _PRIMITIVE_TYPE_CHECKS.get(type_name)
+    if type_check is not None:
+        if type_check(value):
             return value
-    elif type_name == 'boolean':
-        if isinstance(value, bool):
-            return value
-    elif type_name == 'string':
-        return value
     elif type_name in data_types:
         if isinstance(value, dict):
             data_schema = data_types[type_name]['properties']
@@ -224,8 +225,7 @@ def _property_description(path, name=None):
     if not path:
         return name
     if name is not None:
-        path = copy.copy(path)
-        path.append(name)
+        path = tuple(path) + (name,)
     return '.'.join(path)
 
 
@@ -239,7 +239,9 @@ def _merge_schema_and_instance_properties(
         node_name,
         path,
         raise_on_missing_property):
-    path = path or []
+    # the path is kept as a tuple, so nested properties extend it without
+    # copying a list per property
+    path = tuple(path or ())
 
     # validate instance properties don't
     # contain properties that are not defined
@@ -254,8 +256,8 @@ def _merge_schema_and_instance_properties(
             ex.property = key
             raise ex
 
-    merged_properties = dict(
-        flattened_schema_properties.items() + instance_properties.items())
+    merged_properties = flattened_schema_properties.copy()
+    merged_properties.update(instance_properties)
     result = {}
     for key, property_schema in schema_properties.iteritems():
         if key not in merged_properties:
@@ -270,16 +272,14 @@ def _merge_schema_and_instance_properties(
                 raise ex
             else:
                 continue
-        prop_path = copy.copy(path)
-        prop_path.append(key)
         result[key] = parse_value(
-            value=merged_properties.get(key),
+            value=merged_properties[key],
             derived_value=flattened_schema_properties.get(key),
             type_name=property_schema.get('type'),
             data_types=data_types,
             undefined_error_message=undefined_error_message,
             missing_error_message=missing_error_message,
             node_name=node_name,
-            path=prop_path,
+            path=path + (key,),
             raise_on_missing_property=raise_on_missing_property)
     return result
@@ -0,0 +1,81 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks for aria, not collected as tests.
+
+Every module in this package can be run directly, e.g.:
+    python -m tests.benchmarks.functions
+"""
+
+import cPickle
+import os
+import resource
+import sys
+import time
+import traceback
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def isolated(func, *args, **kwargs):
+    """
+    Call func in a forked process, so measurements do not carry over from
+    one call to the next. Returns func's (picklable) result and the growth
+    of the peak resident memory of the process while func ran, in MB.
+    """
+    sys.stdout.flush()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        try:
+            # a forked process' peak starts at its current resident memory
+            start = _peak_memory()
+            result = func(*args, **kwargs)
+            output = True, (result, (_peak_memory() - start) / 1024.0)
+        except BaseException:  # pylint: disable=broad-except
+            output = False, traceback.format_exc()
+        with os.fdopen(write_fd, 'wb') as pipe:
+            cPickle.dump(output, pipe, cPickle.HIGHEST_PROTOCOL)
+        os._exit(0)  # pylint: disable=protected-access
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as pipe:
+        succeeded, output = cPickle.load(pipe)
+    os.waitpid(pid, 0)
+    if not succeeded:
+        raise RuntimeError(output)
+    return output
+
+
+def report(name, **measurements):
+    print '{0}: {1}'.format(name, ', '.join(
+        '{0}={1}'.format(key, _format_measurement(value))
+        for key, value in sorted(measurements.iteritems())))
+
+
+def _format_measurement(value):
+    if isinstance(value, float):
+        return '{0:.4f}'.format(value)
+    return value
+
+
+def _peak_memory():
+    # in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,295 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Deployment planning benchmark: plans are generated directly (bypassing the
+parser) so topologies of arbitrary size can be measured. Every measurement
+runs in its own process and reports its time, the growth of peak memory
+(peak_mb) and the size of the resulting deployment graph (instances and
+relationships).
+"""
+
+import copy
+
+from aria.parser.models import Plan
+from aria.deployment import (
+    prepare_deployment_plan,
+    modify_deployment,
+    build_deployment_graphs,
+)
+from aria.parser.framework.elements.relationships import RelationshipMapping
+
+from . import timed, isolated, report
+
+_relationship_types = RelationshipMapping()  # pylint: disable=invalid-name
+CONTAINED_IN = _relationship_types.contained_in_relationship_type
+CONNECTED_TO = _relationship_types.contained_to_relationship_type
+DEPENDS_ON = _relationship_types.depens_on_relationship_type
+
+
+def relationship(relationship_type, target, connection_type='all_to_all'):
+    type_hierarchy = [DEPENDS_ON]
+    if relationship_type != DEPENDS_ON:
+        type_hierarchy.append(relationship_type)
+    return {
+        'type': relationship_type,
+        'type_hierarchy': type_hierarchy,
+        'target_id': target,
+        'properties': {'connection_type': connection_type},
+        'source_operations': {},
+        'target_operations': {},
+    }
+
+
+def node(name, instances=1, host=None, relationships=()):
+    return {
+        'id': name,
+        'name': name,
+        'host_id': host or name,
+        'properties': {},
+        'operations': {},
+        'relationships': list(relationships),
+        'capabilities': {'scalable': {'properties': {
+            'current_instances': instances,
+            'default_instances': instances,
+            'min_instances': 0,
+            'max_instances': -1,
+        }}},
+    }
+
+
+def scaling_group(members, instances=1):
+    return {
+        'members': list(members),
+        'properties': {
+            'current_instances': instances,
+            'default_instances': instances,
+            'min_instances': 0,
+            'max_instances': -1,
+        },
+    }
+
+
+def plan(nodes, scaling_groups=None):
+    return Plan({
+        'nodes': nodes,
+        'inputs': {},
+        'outputs': {},
+        'policies': {},
+        'scaling_groups': scaling_groups or {},
+    })
+
+
+def hosted_chain(hosts, depth, instances=1):
+    """
+    ``hosts`` host instances, each hosting a chain of ``depth`` nodes with
+    ``instances`` instances per container instance.
+    """
+    nodes = [node('host', instances=hosts)]
+    for index in xrange(depth):
+        container = nodes[-1]['name']
+        nodes.append(node(
+            'node{0}'.format(index),
+            instances=instances,
+            host='host',
+            relationships=[relationship(CONTAINED_IN, container)]))
+    return plan(nodes)
+
+
+def hosted_forest(trees, hosts, depth):
+    """
+    ``trees`` independent hosted chains (see hosted_chain), with hosts named
+    host0, host1, ...
+    """
+    nodes = []
+    for tree in xrange(trees):
+        nodes.append(node('host{0}'.format(tree), instances=hosts))
+        for index in xrange(depth):
+            container = nodes[-1]['name']
+            host = 'host{0}'.format(tree)
+            nodes.append(node(
+                '{0}_node{1}'.format(host, index),
+                host=host,
+                relationships=[relationship(CONTAINED_IN, container)]))
+    return plan(nodes)
+
+
+def all_to_all(sources, targets):
+    """
+    ``sources`` instances connected to each of ``targets`` instances.
+    """
+    return plan([
+        node('target', instances=targets),
+        node('source', instances=sources, relationships=[
+            relationship(CONNECTED_TO, 'target')]),
+    ])
+
+
+def nested_groups(hosts, outer, inner):
+    """
+    ``hosts`` host instances, each hosting ``outer`` instances of a scaling
+    group of a webserver and of a nested group of ``inner`` db instances.
+    """
+    return plan(
+        [node('host', instances=hosts),
+         node('webserver', host='host', relationships=[
+             relationship(CONTAINED_IN, 'host')]),
+         node('db', host='host', relationships=[
+             relationship(CONTAINED_IN, 'host')])],
+        scaling_groups={
+            'inner_group': scaling_group(['db'], instances=inner),
+            'outer_group': scaling_group(
+                ['inner_group', 'webserver'], instances=outer),
+        })
+
+
+def graph_size(node_instances):
+    node_instances = list(node_instances)
+    return {
+        'instances': len(node_instances),
+        'relationships': sum(
+            len(node_instance.get('relationships', ()))
+            for node_instance in node_instances),
+    }
+
+
+def measure_prepare(name, deployment_plan, deployment_kwargs=None,
+                    **parameters):
+    deployment_plan = copy.deepcopy(deployment_plan)
+
+    def prepare():
+        result, elapsed = timed(
+            prepare_deployment_plan,
+            deployment_plan,
+            **deployment_kwargs or {})
+        return dict(graph_size(result['node_instances']), seconds=elapsed)
+    measurements, peak_memory = isolated(prepare)
+    measurements.update(parameters)
+    report(name, peak_mb=peak_memory, **measurements)
+
+
+class DeepcopyCounter(object):
+    """
+    Counts the objects deep copied (copy.deepcopy calls, including its
+    recursive calls) while active.
+    """
+    def __init__(self):
+        self.count = 0
+        self._deepcopy = None
+
+    def __enter__(self):
+        self._deepcopy = deepcopy = copy.deepcopy
+
+        def counting_deepcopy(*args, **kwargs):
+            self.count += 1
+            return deepcopy(*args, **kwargs)
+        copy.deepcopy = counting_deepcopy
+        return self
+
+    def __exit__(self, *_):
+        copy.deepcopy = self._deepcopy
+
+
+def measure_modify(name, deployment_plan, modified_nodes, cached=False,
+                   **parameters):
+    deployment_plan = prepare_deployment_plan(copy.deepcopy(deployment_plan))
+    kwargs = {}
+    if cached:
+        kwargs['previous_deployment_graphs'] = build_deployment_graphs(
+            nodes=deployment_plan['nodes'],
+            node_instances=deployment_plan['node_instances'],
+            scaling_groups=deployment_plan['scaling_groups'])
+
+    def modify():
+        with DeepcopyCounter() as counter:
+            result, elapsed = timed(
+                modify_deployment,
+                nodes=deployment_plan['nodes'],
+                previous_nodes=deployment_plan['nodes'],
+                previous_node_instances=deployment_plan['node_instances'],
+                modified_nodes=modified_nodes,
+                scaling_groups=deployment_plan['scaling_groups'],
+                **kwargs)
+        return dict(
+            graph_size(deployment_plan['node_instances']),
+            added=len(result['added_and_related']),
+            removed=len(result['removed_and_related']),
+            copies=counter.count,
+            seconds=elapsed)
+    measurements, peak_memory = isolated(modify)
+    measurements.update(parameters)
+    report(name, peak_mb=peak_memory, **measurements)
+
+
+def main():
+    for hosts in (100, 1000, 10000):
+        for depth in (1, 9):
+            measure_prepare('hosted_chain', hosted_chain(hosts, depth),
+                            hosts=hosts, depth=depth)
+    for instances in (100, 300, 1000):
+        for compact in (False, True):
+            measure_prepare('all_to_all', all_to_all(instances, instances),
+                            {'compact_all_to_all': compact},
+                            instances_per_node=instances, compact=compact)
+    for outer, inner in ((10, 10), (10, 100)):
+        measure_prepare('nested_groups', nested_groups(100, outer, inner),
+                        outer=outer, inner=inner)
+    for processes in (None, 2):
+        measure_prepare('hosted_forest', hosted_forest(500, hosts=10, depth=9),
+                        {'processes': processes}, processes=processes)
+    for hosts in (300, 1000):
+        measure_modify('hosted_chain_scale_out',
+                       hosted_chain(hosts, depth=4),
+                       {'host': {'instances': hosts + 1}}, hosts=hosts)
+        measure_modify('hosted_chain_scale_in',
+                       hosted_chain(hosts, depth=4),
+                       {'host': {'instances': hosts - 1}}, hosts=hosts)
+    for instances in (10000, 100000):
+        measure_modify('node_scale_in_by_half',
+                       hosted_chain(instances, depth=0),
+                       {'host': {'instances': instances // 2}},
+                       instances_per_node=instances)
+        measure_modify('contained_scale_in_by_half',
+                       hosted_chain(instances // 100, depth=1, instances=100),
+                       {'node0': {'instances': 50}},
+                       instances_per_node=instances)
+    for instances in (10000, 50000):
+        measure_modify('node_scale_out_by_double',
+                       hosted_chain(instances, depth=0),
+                       {'host': {'instances': instances * 2}},
+                       instances_per_node=instances)
+    for outer in (10, 100):
+        measure_modify('nested_groups_scale_out',
+                       nested_groups(100, outer, inner=10),
+                       {'outer_group': {'instances': outer * 2}},
+                       outer=outer)
+        measure_modify('nested_groups_scale_in',
+                       nested_groups(100, outer, inner=10),
+                       {'outer_group': {'instances': outer // 2}},
+                       outer=outer)
+    for instances in (100, 300):
+        measure_modify('all_to_all_scale_out', all_to_all(instances, instances),
+                       {'target': {'instances': instances + 1}},
+                       instances_per_node=instances)
+    for trees in (10, 100):
+        for cached in (False, True):
+            measure_modify('hosted_forest_scale_out',
+                           hosted_forest(trees, hosts=100, depth=4),
+                           {'host0': {'instances': 101}},
+                           cached=cached, trees=trees)
+
+
+if __name__ == '__main__':
+    main()
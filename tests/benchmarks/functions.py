@@ -0,0 +1,140 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Intrinsic functions evaluation benchmark: deeply nested concat expressions
+with get_attribute leaves, evaluated at runtime (resolved) and at plan
+time (left unresolved), and the function scans of a parsed plan compared
+with parsing its functions alone (i.e. what caching function objects
+across scans could spare at most).
+"""
+
+import copy
+
+from yaml import safe_dump
+
+from aria.parser import Parser, scan
+from aria.parser.framework.functions import (
+    evaluate_functions,
+    is_function,
+    parse,
+    plan_evaluation_handler,
+    validate_functions,
+)
+
+from . import timed, report
+from .parser import typed_blueprint
+
+DEPTHS = (10, 50, 100, 150)
+WIDTH = 3
+
+
+class _NodeInstance(dict):
+    id = property(lambda self: self['id'])
+    node_id = property(lambda self: self['node_id'])
+    runtime_properties = property(lambda self: self['runtime_properties'])
+
+
+def nested_concat(depth, width=WIDTH):
+    expression = {'get_attribute': ['SELF', 'leaf']}
+    for _ in xrange(depth):
+        expression = {'concat': [
+            {'get_attribute': ['SELF', 'leaf']}
+            for _ in xrange(width - 1)] + [expression]}
+    return expression
+
+
+def functions_blueprint(templates):
+    """
+    A typed blueprint whose node templates each have a concat of an input,
+    a property and an attribute, and a property of another node template,
+    and with an output per node template.
+    """
+    blueprint = typed_blueprint(templates, types=5, properties=20)
+    blueprint['inputs'] = {'port': {'default': 8080}}
+    for node_template in blueprint['node_templates'].itervalues():
+        node_template['properties'].update(
+            prop0={'concat': [
+                {'get_input': 'port'}, '-',
+                {'get_property': ['SELF', 'prop2']}, '-',
+                {'get_attribute': ['SELF', 'ip']}]},
+            prop4={'get_property': ['node0', 'prop2']})
+    blueprint['outputs'] = dict(
+        ('output{0}'.format(index),
+         {'value': {'get_attribute': ['node{0}'.format(index), 'ip']}})
+        for index in xrange(templates))
+    return blueprint
+
+
+def measure_plan_functions(templates):
+    plan = Parser().parse_from_string(
+        safe_dump(functions_blueprint(templates)))
+    raw_functions = []
+
+    def collect(value, scope, context, path):
+        if is_function(value):
+            raw_functions.append((value, scope, context, path))
+        return value
+
+    scan.scan_service_template(plan, collect)
+
+    def parse_all():
+        for value, scope, context, path in raw_functions:
+            parse(value, scope=scope, context=context, path=path)
+
+    _, elapsed = timed(parse_all)
+    report('plan_functions_parse',
+           templates=templates, functions=len(raw_functions),
+           seconds=elapsed)
+    _, elapsed = timed(validate_functions, copy.deepcopy(plan))
+    report('plan_functions_validate', templates=templates, seconds=elapsed)
+    plan = copy.deepcopy(plan)
+    _, elapsed = timed(
+        scan.scan_service_template,
+        plan, plan_evaluation_handler(plan), replace=True)
+    report('plan_functions_evaluate', templates=templates, seconds=elapsed)
+
+
+def main():
+    node_instance = _NodeInstance(
+        id='node_1', node_id='node', runtime_properties={'leaf': 'x'})
+    for depth in DEPTHS:
+        payload = {'output': nested_concat(depth)}
+        result, elapsed = timed(
+            evaluate_functions,
+            payload,
+            {'self': node_instance['id']},
+            get_node_instance_method=lambda _: node_instance)
+        assert len(result['output']) == depth * (WIDTH - 1) + 1
+        report('nested_concat_runtime',
+               depth=depth, width=WIDTH, seconds=elapsed)
+
+        payload = {'output': nested_concat(depth)}
+        _, elapsed = timed(
+            scan.scan_properties,
+            payload,
+            plan_evaluation_handler(plan=None),
+            scope=scan.OUTPUTS_SCOPE,
+            context={},
+            path='outputs',
+            replace=True)
+        report('nested_concat_plan',
+               depth=depth, width=WIDTH, seconds=elapsed)
+    for templates in (300, 1000):
+        measure_plan_functions(templates)
+
+
+if __name__ == '__main__':
+    main()
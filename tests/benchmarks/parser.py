@@ -0,0 +1,164 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Parser benchmark: blueprints are generated as YAML strings, with many node
+templates sharing a few types whose properties are partly data typed.
+"""
+
+from yaml import safe_dump
+
+from aria.parser import Parser
+from aria.parser.utils import merge_schema_and_instance_properties
+
+from . import timed, report
+
+VERSION = 'tosca_aria_yaml_1_0'
+CONNECTS_TO = 'tosca.relationships.ConnectsTo'
+
+
+def typed_blueprint(templates, types, properties, interfaces=0):
+    """
+    ``templates`` node templates of ``types`` node types, each type with
+    ``properties`` properties, half of them of a nested data type, and
+    ``interfaces`` interfaces of a few operations, and connected to the
+    previous node template.
+    """
+    data_types = {
+        'address': {'properties': {
+            'host': {'type': 'string', 'default': 'localhost'},
+            'port': {'type': 'integer', 'default': 80},
+        }},
+        'endpoint': {'properties': {
+            'address': {'type': 'address'},
+            'secure': {'type': 'boolean', 'default': False},
+            'timeout': {'type': 'float', 'default': 1.5},
+        }},
+    }
+    type_properties = {}
+    for index in xrange(properties):
+        if index % 2:
+            type_properties['prop{0}'.format(index)] = {'type': 'endpoint'}
+        else:
+            type_properties['prop{0}'.format(index)] = {
+                'type': 'string', 'default': 'value'}
+    type_interfaces = dict(
+        ('interface{0}'.format(index), dict(
+            ('op{0}'.format(operation), {
+                'implementation': 'plugin.tasks.op{0}'.format(operation),
+                'inputs': {'retries': {'default': operation}},
+            })
+            for operation in xrange(5)))
+        for index in xrange(interfaces))
+    node_types = {'base': {'properties': type_properties,
+                           'interfaces': type_interfaces}}
+    for index in xrange(types):
+        node_types['type{0}'.format(index)] = {'derived_from': 'base'}
+    node_templates = {}
+    for index in xrange(templates):
+        node_template = {
+            'type': 'type{0}'.format(index % types),
+            'properties': {'prop1': {'address': {'port': index}}},
+        }
+        if index:
+            node_template['relationships'] = [{
+                'type': CONNECTS_TO,
+                'target': 'node{0}'.format(index - 1),
+                'properties': {'connection_type': 'all_to_one'},
+            }]
+        node_templates['node{0}'.format(index)] = node_template
+    return {
+        'tosca_definitions_version': VERSION,
+        'plugins': {'plugin': {'source': 'plugin'}},
+        'data_types': data_types,
+        'node_types': node_types,
+        'relationships': {
+            'tosca.relationships.Root': {'properties': {
+                'connection_type': {'type': 'string',
+                                    'default': 'all_to_all'},
+            }},
+            CONNECTS_TO: {'derived_from': 'tosca.relationships.Root'},
+        },
+        'node_templates': node_templates,
+    }
+
+
+def nested_data_types(depth, width):
+    """
+    Data types ``level0`` to ``level<depth>``, each with ``width`` defaulted
+    primitive properties and the next level's data type as property
+    ``nested``, and an instance of ``level0`` assigning the leaves.
+    """
+    data_types = {}
+    for level in xrange(depth + 1):
+        properties = {}
+        for index in xrange(width):
+            properties['int{0}'.format(index)] = {
+                'type': 'integer', 'default': index}
+            properties['str{0}'.format(index)] = {
+                'type': 'string', 'default': 'value'}
+        if level < depth:
+            properties['nested'] = {'type': 'level{0}'.format(level + 1)}
+        data_types['level{0}'.format(level)] = {'properties': properties}
+    instance = leaf = {}
+    for _ in xrange(depth):
+        leaf['nested'] = {}
+        leaf = leaf['nested']
+    leaf['int0'] = 42
+    return data_types, {'value': {'type': 'level0'}}, {'value': instance}
+
+
+def measure_properties_merge(name, data_types, schema, instance,
+                             iterations, **parameters):
+    def merge_all():
+        for _ in xrange(iterations):
+            merge_schema_and_instance_properties(
+                instance_properties=instance,
+                schema_properties=schema,
+                data_types=data_types,
+                undefined_error_message='{0} {1}',
+                missing_error_message='{0} {1}',
+                node_name='node')
+    _, elapsed = timed(merge_all)
+    report(name, iterations=iterations, seconds=elapsed, **parameters)
+
+
+def measure_parse(name, blueprint, **parameters):
+    dsl_string = safe_dump(blueprint)
+    plan, elapsed = timed(Parser().parse_from_string, dsl_string)
+    report(name,
+           nodes=len(plan['nodes']),
+           seconds=elapsed,
+           **parameters)
+    return plan
+
+
+def main():
+    for depth in (2, 8):
+        data_types, schema, instance = nested_data_types(depth, width=10)
+        measure_properties_merge('nested_data_types', data_types, schema,
+                                 instance, iterations=1000,
+                                 depth=depth, width=10)
+    for templates in (100, 300, 1000):
+        measure_parse('typed_blueprint',
+                      typed_blueprint(templates, types=5, properties=20),
+                      types=5, properties=20)
+    measure_parse('typed_blueprint',
+                  typed_blueprint(300, types=5, properties=20, interfaces=5),
+                  types=5, properties=20, interfaces=5)
+
+
+if __name__ == '__main__':
+    main()
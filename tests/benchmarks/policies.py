@@ -0,0 +1,106 @@
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Scaling groups validation benchmark: node templates and groups are
+generated directly (bypassing the rest of the parser) so groups of
+arbitrary size can be measured.
+"""
+
+from aria.parser.framework.elements.policies import Policies
+from aria.parser.framework.elements.relationships import RelationshipMapping
+
+from . import timed, report
+
+CONTAINED_IN = RelationshipMapping().contained_in_relationship_type
+
+
+def node_template(name, host=None):
+    relationships = []
+    if host:
+        relationships.append({
+            'type': CONTAINED_IN,
+            'type_hierarchy': [CONTAINED_IN],
+            'target_id': host,
+        })
+    return {'id': name, 'relationships': relationships}
+
+
+def hosted_scaling_group(members):
+    """
+    ``members`` nodes hosted on a single host, all members of one scaling
+    group.
+    """
+    node_templates = [node_template('host')]
+    node_templates.extend(
+        node_template('node{0}'.format(index), 'host')
+        for index in xrange(members))
+    return node_templates, {'group': {
+        'members': [template['id'] for template in node_templates[1:]],
+    }}
+
+
+def hosts_scaling_group(hosts, depth, nested=False):
+    """
+    ``hosts`` hosts, each hosting a chain of ``depth`` nodes, all members of
+    one scaling group. When ``nested``, each host and its chain are members
+    of their own group, which is a member of the scaling group.
+    """
+    node_templates = []
+    groups = {'group': {'members': []}}
+    for host_index in xrange(hosts):
+        members = ['host{0}'.format(host_index)]
+        node_templates.append(node_template(members[0]))
+        for index in xrange(depth):
+            name = '{0}_node{1}'.format(members[0], index)
+            node_templates.append(node_template(name, members[-1]))
+            members.append(name)
+        if nested:
+            group_name = '{0}_group'.format(members[0])
+            groups[group_name] = {'members': members}
+            groups['group']['members'].append(group_name)
+        else:
+            groups['group']['members'].extend(members)
+    return node_templates, groups
+
+
+def measure_validation(name, (node_templates, scaling_groups), **parameters):
+    policies = Policies(context=None, initial_value={}, name='policies')
+    members = sum(
+        len(group['members']) for group in scaling_groups.itervalues())
+    _, elapsed = timed(
+        policies._validate_and_update_groups,  # pylint: disable=protected-access
+        scaling_groups,
+        node_templates)
+    report(name,
+           members=members,
+           remaining_members=len(scaling_groups['group']['members']),
+           seconds=elapsed,
+           **parameters)
+
+
+def main():
+    for members in (100, 300, 1000):
+        measure_validation('hosted_scaling_group',
+                           hosted_scaling_group(members))
+    for hosts in (100, 300, 1000):
+        for nested in (False, True):
+            measure_validation('hosts_scaling_group',
+                               hosts_scaling_group(hosts, 2, nested),
+                               hosts=hosts, nested=nested)
+
+
+if __name__ == '__main__':
+    main()
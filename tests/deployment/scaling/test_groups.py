@@ -15,11 +15,25 @@
 
 
 import copy
+import cPickle
+import os
+from cStringIO import StringIO
+from shutil import rmtree
+from tempfile import mkdtemp
 
 import networkx
 
 from aria.parser.framework.elements.policies import PolicyInstanceType
+from aria.deployment import (
+    SequentialInstanceIdGenerator,
+    build_deployment_graphs,
+    dump_deployment_graphs,
+    load_deployment_graphs,
+)
+from aria.deployment import snapshot as deployment_snapshot
+from aria.deployment.snapshot import SnapshotError
 from aria.deployment.relationships_graph import (
+    Context,
     build_node_graph,
     build_previous_deployment_node_graph,
 )
@@ -579,6 +593,198 @@ class TestMultiInstanceGroups(BaseTestMultiInstance):
             },
         )
 
+    def test_group_with_some_random_connections_compact_all_to_all(self):
+        self._parse_multi(
+            groups={
+                'group1': {'instances': 2,
+                           'members': ['group2', 'group3', 'host2']},
+                'group2': {'instances': 2, 'members': ['host1']},
+                'group3': {'instances': 2, 'members': ['db', 'db_c']},
+            },
+            nodes={
+                'host1': {'type': 'Compute', 'instances': 2},
+                'host2': {'type': 'Compute', 'instances': 2,
+                          'ConnectsTo': ['host1']},
+                'db': {'type': 'Root', 'HostedOn': 'host1', 'instances': 2},
+                'db_c': {'type': 'Root', 'HostedOn': 'host1',
+                         'ConnectsTo': ['db'], 'instances': 2},
+            })
+
+        def node_instances(compact_all_to_all):
+            plan = self.prepare_deployment_plan(deployment_kwargs={
+                'instance_id_generator': SequentialInstanceIdGenerator(),
+                'compact_all_to_all': compact_all_to_all,
+            })
+            result = sorted(plan['node_instances'], key=lambda i: i['id'])
+            for node_instance in result:
+                node_instance['relationships'].sort(
+                    key=lambda r: (r['type'], r['target_id']))
+            return result
+
+        expected = node_instances(compact_all_to_all=False)
+        self.assertEqual(
+            64, len(self.nodes_relationships(expected, target_name='db')))
+        self.assertEqual(
+            80, len(self.nodes_relationships(expected, target_name='host1')))
+        self.assertEqual(expected, node_instances(compact_all_to_all=True))
+
+    def test_nested_groups_node_graph(self):
+        plan = self._parse_multi(
+            groups={
+                'inner_group': {
+                    'members': ['db'],
+                },
+                'outer_group': {
+                    'members': ['inner_group', 'webserver'],
+                },
+            },
+            nodes={
+                'host': {'type': 'Compute'},
+                'db': {'type': 'Root', 'HostedOn': 'host'},
+                'webserver': {'type': 'Root', 'HostedOn': 'host'},
+            })
+        nodes = copy.deepcopy(plan['nodes'])
+        graph = build_node_graph(
+            nodes=plan['nodes'],
+            scaling_groups=plan['scaling_groups'])
+        self.assertTrue(graph.has_edge('outer_group', 'host'))
+        self.assertFalse(graph.has_edge('inner_group', 'host'))
+        # the replaced contained in relationship is a copy of the node's
+        self.assertEqual(
+            'host', graph['db']['inner_group']['relationship']['replaced'])
+        self.assertEqual(nodes, plan['nodes'])
+        ctx = Context(
+            plan_node_graph=graph,
+            deployment_node_graph=networkx.DiGraph())
+        self.assertEqual(
+            'outer_group', ctx.minimal_containing_group('db', 'webserver'))
+        self.assertEqual(
+            'inner_group', ctx.minimal_containing_group('db', 'db'))
+        self.assertIsNone(ctx.minimal_containing_group('db', 'host'))
+
+    def test_deployment_graphs_snapshot(self):
+        plan = self._parse_multi(
+            groups={
+                'host_group': {
+                    'instances': 2,
+                    'members': ['host'],
+                },
+                'db_group': {
+                    'members': ['db'],
+                },
+            },
+            nodes={
+                'host': {'type': 'Compute'},
+                'db': {'type': 'Root',
+                       'HostedOn': 'host',
+                       'ConnectsTo': ['ip']},
+                'ip': {'type': 'Root'},
+            })
+        graphs = build_deployment_graphs(
+            nodes=plan['nodes'],
+            node_instances=plan['node_instances'],
+            scaling_groups=plan['scaling_groups'])
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'snapshot')
+        with open(path, 'wb') as snapshot:
+            dump_deployment_graphs(graphs, snapshot)
+        with open(path, 'rb') as snapshot:
+            loaded_graphs = load_deployment_graphs(snapshot)
+        for graph, loaded_graph in zip(graphs, loaded_graphs):
+            self.assertEqual(graph.graph, loaded_graph.graph)
+            self.assertEqual(
+                sorted(graph.nodes(data=True)),
+                sorted(loaded_graph.nodes(data=True)))
+            self.assertEqual(
+                sorted(graph.edges(data=True)),
+                sorted(loaded_graph.edges(data=True)))
+
+        modified_nodes = {'host_group': {'instances': 3}}
+        modification = self.modify_multi(
+            plan, modified_nodes,
+            instance_id_generator=SequentialInstanceIdGenerator())
+        self.assertEqual(2, len([
+            instance for instance in modification['added_and_related']
+            if instance.get('modification') == 'added']))
+        self.assertEqual(
+            modification,
+            self.modify_multi(
+                plan, modified_nodes,
+                instance_id_generator=SequentialInstanceIdGenerator(),
+                previous_deployment_graphs=loaded_graphs))
+
+        with open(path, 'rb') as snapshot:
+            content = snapshot.read()
+        # the payload starts right after the 47 bytes header
+        for corrupt_content in ['', 'not a snapshot', content[:-1],
+                                content + '\0', content[:40],
+                                content[:47] + '!' + content[48:]]:
+            self.assertRaises(SnapshotError, load_deployment_graphs,
+                              StringIO(corrupt_content))
+
+    def test_deployment_graphs_snapshot_round_trip(self):
+        plan = self._parse_multi(
+            groups={
+                'host_group': {
+                    'instances': 2,
+                    'members': ['host'],
+                },
+            },
+            nodes={
+                'host': {'type': 'Compute'},
+                'db': {'type': 'Root',
+                       'HostedOn': 'host',
+                       'ConnectsTo': ['ip']},
+                'ip': {'type': 'Root'},
+            })
+        for node_instance in plan['node_instances']:
+            node_instance['runtime_properties'] = {
+                'str': 'value', u'unicode': u'h\xe9', 'tuple': (1, 2L),
+                1: 1.5, (2, 'key'): [True, None, {3: 'three'}]}
+            for relationship in node_instance['relationships']:
+                relationship['data'] = {
+                    'tuple': ('a', u'b'), 4: 4L, None: [0.25]}
+        graphs = build_deployment_graphs(
+            nodes=plan['nodes'],
+            node_instances=plan['node_instances'],
+            scaling_groups=plan['scaling_groups'])
+        stream = StringIO()
+        dump_deployment_graphs(graphs, stream)
+        loaded_graphs = load_deployment_graphs(StringIO(stream.getvalue()))
+
+        def typed(value):
+            if isinstance(value, dict):
+                return type(value), sorted(
+                    (typed(key), typed(item))
+                    for key, item in value.iteritems())
+            if isinstance(value, (list, tuple)):
+                return type(value), [typed(item) for item in value]
+            return type(value), value
+
+        for graph, loaded_graph in zip(graphs, loaded_graphs):
+            self.assertEqual(typed(graph.graph), typed(loaded_graph.graph))
+            self.assertEqual(typed(graph.node), typed(loaded_graph.node))
+            self.assertEqual(typed(graph.edge), typed(loaded_graph.edge))
+        self.assertTrue(any(
+            'data' in data['relationship']
+            for _, _, data in loaded_graphs[0].edges_iter(data=True)))
+
+        plan['node_instances'][0]['runtime_properties']['set'] = set()
+        graphs = build_deployment_graphs(
+            nodes=plan['nodes'],
+            node_instances=plan['node_instances'],
+            scaling_groups=plan['scaling_groups'])
+        self.assertRaises(SnapshotError, dump_deployment_graphs,
+                          graphs, StringIO())
+
+        # snapshots referring to classes or functions are refused as well
+        payload = cPickle.dumps([[], [], [set()]], 2)
+        content = deployment_snapshot._HEADER.pack(  # pylint: disable=protected-access
+            'ARIADG', 3, len(payload), 0, 0, 0, 0) + payload + '\0' * 8
+        self.assertRaises(SnapshotError, load_deployment_graphs,
+                          StringIO(content))
+
     def test_group_with_external_nodes_not_in_any_group1(self):
         return self._test(
             groups={
@@ -2916,3 +3122,55 @@ class TestMultiInstanceGroups(BaseTestMultiInstance):
         })
 
         return self.prepare_deployment_plan()
+
+
+class TestContainmentChains(BaseTestMultiInstance):
+    @staticmethod
+    def _contained_graph(*edges):
+        graph = networkx.DiGraph()
+        for source, target in edges:
+            for node_instance_id in (source, target):
+                name, group = node_instance_id.rsplit('_', 1)[0], False
+                if name.startswith('group'):
+                    group = True
+                graph.add_node(node_instance_id, node={
+                    'id': node_instance_id,
+                    'name': name,
+                    'group': group,
+                })
+            graph.add_edge(source, target)
+        return graph
+
+    def test_containing_groups(self):
+        ctx = Context(
+            plan_node_graph=networkx.DiGraph(),
+            deployment_node_graph=networkx.DiGraph())
+        ctx.deployment_contained_graph = self._contained_graph(
+            ('db_1', 'host_1'),
+            ('db_2', 'host_1'),
+            ('host_1', 'groupa_1'),
+            ('groupa_1', 'groupb_1'))
+        self.assertEqual('groupa_1', ctx.containing_group_id('db_1', 'groupa'))
+        self.assertEqual('groupb_1', ctx.containing_group_id('db_2', 'groupb'))
+        self.assertIsNone(ctx.containing_group_id('db_1', 'groupc'))
+        self.assertEqual(
+            ([], {'name': 'host', 'id': 'host_1'}),
+            ctx.containing_group_instances(
+                'db_1', ctx.deployment_contained_graph))
+        self.assertEqual(
+            ([{'name': 'groupa', 'id': 'groupa_1'},
+              {'name': 'groupb', 'id': 'groupb_1'}], None),
+            ctx.containing_group_instances(
+                'host_1', ctx.deployment_contained_graph))
+
+        ctx.deployment_contained_graph = self._contained_graph(
+            ('db_1', 'host_1'),
+            ('host_1', 'groupc_1'))
+        self.assertIsNone(ctx.containing_group_id('db_1', 'groupa'))
+        self.assertEqual('groupc_1', ctx.containing_group_id('db_1', 'groupc'))
+
+        ctx.deployment_contained_graph.add_edge('groupc_1', 'groupa_1')
+        ctx.deployment_contained_graph.node['groupa_1']['node'] = {
+            'id': 'groupa_1', 'name': 'groupa', 'group': True}
+        ctx.invalidate_containment()
+        self.assertEqual('groupa_1', ctx.containing_group_id('db_1', 'groupa'))
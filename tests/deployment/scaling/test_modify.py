@@ -13,8 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 from itertools import chain
 
+from aria.deployment import (
+    build_deployment_graphs,
+    SequentialInstanceIdGenerator,
+)
 from ...suite import BaseTestMultiInstance
 
 
@@ -355,6 +360,141 @@ class TestMultiInstanceModify(BaseTestMultiInstance):
             chain(*(node['relationships'] for node in db_nodes)),
             self.node_ids(host2_nodes), 'host2')
 
+    def test_stream_modification(self):
+        self.template.version_section('1.0')
+        self.template += self.BASE_BLUEPRINT
+        self.template += """
+    host1:
+        type: tosca.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+    host2:
+        type: tosca.nodes.Compute
+    db:
+        type: db
+        relationships:
+            -   type: tosca.relationships.HostedOn
+                target: host1
+            -   type: tosca.relationships.ConnectsTo
+                target: host2
+"""
+        plan = self.prepare_deployment_plan()
+        modified_nodes = {'host1': {'instances': 1},
+                          'host2': {'instances': 2}}
+
+        modification = self.modify_multi(
+            plan, modified_nodes,
+            instance_id_generator=SequentialInstanceIdGenerator())
+        self.assert_modification(modification, 2, 3, 1, 2)
+        self.assertTrue(modification['extended_and_related'])
+        streamed = self.modify_multi(
+            plan, modified_nodes,
+            instance_id_generator=SequentialInstanceIdGenerator(),
+            stream_node_instances=True)
+        chunked = self.modify_multi(
+            plan, modified_nodes,
+            instance_id_generator=SequentialInstanceIdGenerator(),
+            stream_node_instances=True,
+            chunk_size=1)
+        for key, node_instances in modification.iteritems():
+            self.assertEqual(node_instances, list(streamed[key]))
+            chunks = list(chunked[key])
+            self.assertTrue(all(len(chunk) == 1 for chunk in chunks))
+            self.assertEqual(node_instances, list(chain(*chunks)))
+
+    def test_cached_previous_deployment_graphs(self):
+        self.template.version_section('1.0')
+        self.template += self.BASE_BLUEPRINT
+        self.template += """
+    host1:
+        type: tosca.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+    host2:
+        type: tosca.nodes.Compute
+    host3:
+        type: tosca.nodes.Compute
+    db:
+        type: db
+        relationships:
+            -   type: tosca.relationships.HostedOn
+                target: host1
+            -   type: tosca.relationships.ConnectsTo
+                target: host2
+    webserver:
+        type: webserver
+        relationships:
+            -   type: tosca.relationships.HostedOn
+                target: host3
+"""
+        plan = self.prepare_deployment_plan()
+        previous_deployment_graphs = build_deployment_graphs(
+            nodes=plan['nodes'],
+            node_instances=plan['node_instances'],
+            scaling_groups=plan['scaling_groups'])
+        for modified_nodes, expected in [
+                ({'host1': {'instances': 3}}, (3, 0, 2, 0)),
+                ({'host1': {'instances': 1}}, (0, 3, 0, 2))]:
+            modification = self.modify_multi(
+                plan, modified_nodes,
+                instance_id_generator=SequentialInstanceIdGenerator())
+            self.assert_modification(modification, *expected)
+            for _ in range(2):
+                result = self.modify_multi(
+                    plan, modified_nodes,
+                    instance_id_generator=SequentialInstanceIdGenerator(),
+                    previous_deployment_graphs=previous_deployment_graphs)
+                self.assertEqual(modification, result)
+                # changing the results leaves the cached graphs as they are
+                for node_instances in result.itervalues():
+                    for node_instance in node_instances:
+                        for relationship in node_instance['relationships']:
+                            relationship['target_id'] = 'changed'
+
+    def test_modification_leaves_previous_instances_untouched(self):
+        self.template.version_section('1.0')
+        self.template += self.BASE_BLUEPRINT
+        self.template += """
+    host1:
+        type: tosca.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+    host2:
+        type: tosca.nodes.Compute
+    db:
+        type: db
+        relationships:
+            -   type: tosca.relationships.HostedOn
+                target: host1
+            -   type: tosca.relationships.ConnectsTo
+                target: host2
+"""
+        plan = self.prepare_deployment_plan()
+        for instance in plan['node_instances']:
+            instance['runtime_properties'] = {'key': {'nested': 'value'}}
+        previous_node_instances = copy.deepcopy(plan['node_instances'])
+        modification = self.modify_multi(
+            plan, {'host1': {'instances': 1}, 'host2': {'instances': 2}})
+        self.assertEqual(previous_node_instances, plan['node_instances'])
+        previous_instance_ids = set(
+            id(instance) for instance in plan['node_instances'])
+        for node_instances in modification.itervalues():
+            for instance in node_instances:
+                self.assertNotIn(id(instance), previous_instance_ids)
+                # nested values are copies as well
+                if 'runtime_properties' in instance:
+                    instance['runtime_properties']['key']['nested'] = 'changed'
+        self.assertTrue(any(
+            'runtime_properties' in instance
+            for instance in modification['removed_and_related']))
+        self.assertEqual(previous_node_instances, plan['node_instances'])
+
     def test_modified_single_node_added_with_connected_2(self):
         self.template.version_section('1.0')
         self.template += self.BASE_BLUEPRINT
@@ -711,6 +851,78 @@ class TestMultiInstanceModify(BaseTestMultiInstance):
             })
         self.assert_modification(modification, 0, 6, 0, 3)
 
+    def test_removed_ids_include_and_exclude_hints(self):
+        self.template.version_section('1.0')
+        self.template += self.BASE_BLUEPRINT
+        self.template += """
+    host:
+        type: tosca.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 3
+"""
+        plan = self.prepare_deployment_plan()
+        host_ids = self.node_ids(
+            self.nodes_by_name(plan['node_instances'], 'host'))
+
+        def removed_host_ids(modified_node):
+            modified_node['instances'] = 1
+            modification = self.modify_multi(plan, {'host': modified_node})
+            return set(self.node_ids(self.nodes_by_name(
+                modification['removed_and_related'], 'host')))
+
+        # the included id is removed first, then the ones not excluded
+        self.assertEqual(
+            set([host_ids[0], host_ids[2]]),
+            removed_host_ids({
+                'removed_ids_include_hint': [host_ids[0], 'unknown'],
+                'removed_ids_exclude_hint': [host_ids[1]],
+            }))
+        # excluded ids are still removed when there are not enough others
+        self.assertEqual(2, len(removed_host_ids({
+            'removed_ids_exclude_hint': host_ids[1:],
+        })))
+        self.assertIn(host_ids[0], removed_host_ids({
+            'removed_ids_exclude_hint': host_ids[1:],
+        }))
+
+    def test_removed_ids_follow_previous_instances_order(self):
+        self.template.version_section('1.0')
+        self.template += self.BASE_BLUEPRINT
+        self.template += """
+    host:
+        type: tosca.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 20
+"""
+        plan = self.prepare_deployment_plan()
+        node_instances = plan['node_instances']
+
+        def removed_host_ids(**kwargs):
+            modification = self.modify_multi(
+                plan, {'host': {'instances': 5}}, **kwargs)
+            return self.node_ids(self.nodes_by_name(
+                modification['removed_and_related'], 'host'))
+
+        for previous_node_instances in [node_instances,
+                                        node_instances[::-1]]:
+            plan['node_instances'] = previous_node_instances
+            host_ids = self.node_ids(
+                self.nodes_by_name(previous_node_instances, 'host'))
+            previous_deployment_graphs = build_deployment_graphs(
+                nodes=plan['nodes'],
+                node_instances=previous_node_instances,
+                scaling_groups=plan['scaling_groups'])
+            for _ in range(2):
+                self.assertEqual(
+                    sorted(host_ids[:15]), sorted(removed_host_ids()))
+                self.assertEqual(
+                    sorted(host_ids[:15]), sorted(removed_host_ids(
+                        previous_deployment_graphs=previous_deployment_graphs)))
+
     def _test_base_nodes(self):
         self.template.version_section('1.0')
         self.template += self.BASE_BLUEPRINT
@@ -13,15 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from itertools import groupby
+from itertools import chain, groupby
 from random import randint
 
-from mock import patch
-
 from aria.exceptions import (
     IllegalConnectedToConnectionType,
     UnsupportedRelationship,
     UnsupportedAllToOneInGroup,
+    NodeInstanceIdsExhausted,
+)
+from aria.deployment import (
+    RandomInstanceIdGenerator,
+    SequentialInstanceIdGenerator,
+    PathHashInstanceIdGenerator,
 )
 from ...suite import BaseTestMultiInstance
 
@@ -438,10 +442,172 @@ node_templates:
 node_types:
   type: {1}
 """.format(instances, '{}')
-        with patch('aria.deployment.relationships_graph._generate_id', lambda: randint(1, instances)):
-            plan = self.prepare_deployment_plan()
+        def small_range_generator(node_id, parent_node_instance_id):
+            return '{0}_{1}'.format(node_id, randint(1, instances))
+        plan = self.prepare_deployment_plan(deployment_kwargs={
+            'instance_id_generator': small_range_generator})
         self.assertEqual(instances, len(plan['node_instances']))
 
+    def test_exhausted_id_range(self):
+        self.template.version_section('1.0')
+        self.template += """
+node_templates:
+  node:
+    capabilities:
+      scalable:
+        properties:
+          default_instances: 17
+    type: type
+node_types:
+  type: {}
+"""
+        for instance_id_generator in [RandomInstanceIdGenerator(digits=1),
+                                      PathHashInstanceIdGenerator(digits=1)]:
+            self.assertRaises(
+                NodeInstanceIdsExhausted,
+                self.prepare_deployment_plan,
+                deployment_kwargs={
+                    'instance_id_generator': instance_id_generator})
+
+    def _instance_ids_template(self):
+        self.template.version_section('1.0')
+        self.template += self.BASE_BLUEPRINT
+        self.template += """
+    host:
+        type: tosca.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+    db:
+        type: db
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 2
+        relationships:
+            -   type: tosca.relationships.HostedOn
+                target: host
+"""
+
+    def _prepare_instance_ids(self, instance_id_generator):
+        plan = self.prepare_deployment_plan(deployment_kwargs={
+            'instance_id_generator': instance_id_generator})
+        return plan, sorted(self.node_ids(plan['node_instances']))
+
+    def _modify_instance_ids(self, plan, instance_id_generator):
+        generated = []
+
+        def generate(node_id, parent_node_instance_id):
+            generated.append(instance_id_generator(
+                node_id, parent_node_instance_id))
+            return generated[-1]
+        generate.continue_from = instance_id_generator.continue_from
+        modification = self.modify_multi(
+            plan,
+            modified_nodes={'host': {'instances': 3}},
+            instance_id_generator=generate)
+        added = sorted(instance['id']
+                       for instance in modification['added_and_related']
+                       if instance.get('modification') == 'added')
+        # continuing from the existing ids, no generated id is taken
+        self.assertEqual(sorted(generated), added)
+        return added
+
+    def test_sequential_instance_ids(self):
+        self._instance_ids_template()
+        plan, ids = self._prepare_instance_ids(SequentialInstanceIdGenerator())
+        self.assertEqual(
+            ['db_1', 'db_2', 'db_3', 'db_4', 'host_1', 'host_2'], ids)
+        added = self._modify_instance_ids(
+            plan, SequentialInstanceIdGenerator())
+        self.assertEqual(['db_5', 'db_6', 'host_3'], added)
+
+    def test_seeded_random_instance_ids(self):
+        self._instance_ids_template()
+        _, ids = self._prepare_instance_ids(
+            RandomInstanceIdGenerator(digits=12, seed=7))
+        self.assertEqual(6, len(set(ids)))
+        for instance_id in ids:
+            self.assertEqual(12, len(instance_id.rsplit('_', 1)[1]))
+        _, same_ids = self._prepare_instance_ids(
+            RandomInstanceIdGenerator(digits=12, seed=7))
+        self.assertEqual(ids, same_ids)
+
+    def test_path_hash_instance_ids(self):
+        self._instance_ids_template()
+        _, ids = self._prepare_instance_ids(PathHashInstanceIdGenerator())
+        self.assertEqual(6, len(set(ids)))
+        plan, same_ids = self._prepare_instance_ids(
+            PathHashInstanceIdGenerator())
+        self.assertEqual(ids, same_ids)
+        added = self._modify_instance_ids(plan, PathHashInstanceIdGenerator())
+        self.assertEqual(3, len(added))
+        self.assertFalse(set(added) & set(ids))
+
+    def test_path_hash_unicode_instance_ids(self):
+        generate = PathHashInstanceIdGenerator()
+        instance_id = generate(u'n\xf3de', u'h\xf3st_1')
+        self.assertTrue(instance_id.startswith(u'n\xf3de_'))
+        self.assertNotEqual(instance_id, generate(u'n\xf3de', u'h\xf3st_1'))
+
+    def test_processes(self):
+        self._instance_ids_template()
+        self.template += """
+    web_host:
+        type: tosca.nodes.Compute
+        capabilities:
+            scalable:
+                properties:
+                    default_instances: 3
+    webserver:
+        type: webserver
+        relationships:
+            -   type: tosca.relationships.HostedOn
+                target: web_host
+            -   type: tosca.relationships.ConnectsTo
+                target: db
+"""
+        for generator_cls in (SequentialInstanceIdGenerator,
+                              PathHashInstanceIdGenerator):
+            plan = self.prepare_deployment_plan(deployment_kwargs={
+                'instance_id_generator': generator_cls()})
+            parallel_plan = self.prepare_deployment_plan(deployment_kwargs={
+                'instance_id_generator': generator_cls(),
+                'processes': 2})
+            self.assertEqual(12, len(parallel_plan['node_instances']))
+            self.assertEqual(
+                sorted(plan['node_instances'], key=lambda n: n['id']),
+                sorted(parallel_plan['node_instances'],
+                       key=lambda n: n['id']))
+
+    def test_processes_unpicklable_instance_id_generator(self):
+        self._instance_ids_template()
+        generator = SequentialInstanceIdGenerator()
+        self.assertRaisesRegexp(
+            ValueError, 'picklable instance_id_generator',
+            self.prepare_deployment_plan, deployment_kwargs={
+                'instance_id_generator': lambda *args: generator(*args),
+                'processes': 2})
+
+    def test_stream_node_instances(self):
+        self._instance_ids_template()
+        plan = self.prepare_deployment_plan(deployment_kwargs={
+            'instance_id_generator': SequentialInstanceIdGenerator()})
+        streamed_plan = self.prepare_deployment_plan(deployment_kwargs={
+            'instance_id_generator': SequentialInstanceIdGenerator(),
+            'stream_node_instances': True})
+        self.assertNotIsInstance(streamed_plan['node_instances'], list)
+        self.assertEqual(
+            plan['node_instances'], list(streamed_plan['node_instances']))
+        chunked_plan = self.prepare_deployment_plan(deployment_kwargs={
+            'instance_id_generator': SequentialInstanceIdGenerator(),
+            'stream_node_instances': True,
+            'chunk_size': 4})
+        chunks = list(chunked_plan['node_instances'])
+        self.assertEqual([4, 2], [len(chunk) for chunk in chunks])
+        self.assertEqual(plan['node_instances'], list(chain(*chunks)))
+
     def test_node_instances_relationship_order(self):
         self.template.version_section('1.0')
         self.template += self.BASE_BLUEPRINT
@@ -18,6 +18,7 @@ from aria.parser.framework.functions import (
     unregister,
     register,
     parse,
+    evaluate_functions,
     evaluate_outputs,
 )
 from ..suite import PrepareDeploymentPlanTestCase
@@ -30,6 +31,7 @@ class TestFunctionRegistration(PrepareDeploymentPlanTestCase):
 
     def cleanup(self):
         unregister('to_upper')
+        unregister('counted')
 
     def test_registration(self):
         @register(name='to_upper')
@@ -100,6 +102,39 @@ outputs:
         self.assertEqual('PROPERTY_VALUE', o['output2'])
         self.assertEqual('ATTRIBUTE_VALUE', o['output3'])
 
+    def test_nested_functions_evaluated_once(self):
+        evaluated = []
+
+        @register(name='counted')
+        class Counted(Function):
+            def __init__(self, args, **kwargs):
+                self.arg = None
+                super(Counted, self).__init__(args, **kwargs)
+
+            def parse_args(self, args):
+                self.arg = args
+
+            def evaluate_runtime(self, storage):
+                return self.evaluate(plan=None)
+
+            def evaluate(self, plan):
+                evaluated.append(self.arg)
+                return self.arg
+
+            def validate(self, plan):
+                pass
+
+        depth = 20
+        payload = {'counted': 0}
+        for index in range(1, depth):
+            payload = {'concat': [{'counted': index}, payload]}
+        payload = evaluate_functions({'output': payload}, {})
+
+        self.assertEqual(
+            ''.join(str(index) for index in reversed(range(depth))),
+            payload['output'])
+        self.assertEqual(range(depth), sorted(evaluated))
+
 
 class NodeInstance(dict):
     @property
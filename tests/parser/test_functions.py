@@ -14,6 +14,10 @@
 # limitations under the License.
 
 from functools import partial
+
+from testtools import TestCase
+
+from aria.parser.framework.functions import is_function
 from ..suite import ParserTestCase
 
 
@@ -221,3 +225,13 @@ outputs:
         assert_with('SELF')
         assert_with('SOURCE')
         assert_with('TARGET')
+
+
+class TestParse(TestCase):
+    def test_is_function(self):
+        self.assertTrue(is_function({'get_input': 'a'}))
+        self.assertTrue(is_function({'get_input': 1}))
+        self.assertFalse(is_function({'get_input': 'a', 'b': 'c'}))
+        self.assertFalse(is_function({'not_a_function': 'a'}))
+        self.assertFalse(is_function(['get_input']))
+        self.assertFalse(is_function('get_input'))
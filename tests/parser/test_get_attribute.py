@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 from collections import defaultdict
 
 from testtools import TestCase
@@ -20,7 +21,12 @@ from testtools import TestCase
 from aria.parser.exceptions import (
     FunctionEvaluationError,
 )
-from aria.parser.framework.functions import evaluate_functions
+from aria.parser.framework.functions import (
+    evaluate_functions,
+    evaluate_functions_bulk,
+    evaluate_outputs,
+    RuntimeEvaluationStorage,
+)
 from aria.parser.framework.elements.relationships import RelationshipMapping
 
 CONTAINED_IN_REL_TYPE = RelationshipMapping().contained_in_relationship_type
@@ -387,6 +393,232 @@ class TestEvaluateFunctions(TestCase):
             {}, get_node_instances, get_node_instance, None)
         self.assertIn('unambiguously', str(exc))
 
+    def test_evaluate_functions_bulk(self):
+        calls = defaultdict(int)
+
+        def get_node_instance(node_instance_id):
+            calls[node_instance_id] += 1
+            return NodeInstance({
+                'id': node_instance_id,
+                'node_id': 'webserver',
+                'runtime_properties': {'a': node_instance_id},
+            })
+
+        def get_node(node_id):
+            return Node({'id': node_id})
+
+        payload = {
+            'a': {'get_attribute': ['SELF', 'a']},
+            'b': {'concat': [{'get_attribute': ['SELF', 'a']}, '_b']},
+            'c': {'static': [1, {'key': 'value'}]},
+            'd': [{'get_attribute': ['TARGET', 'a']}, 'd'],
+        }
+        original_payload = copy.deepcopy(payload)
+        contexts = [
+            {'self': 'node{0}'.format(index), 'target': 'target'}
+            for index in range(3)]
+
+        results = evaluate_functions_bulk(
+            payload,
+            contexts,
+            get_node_instance_method=get_node_instance,
+            get_node_method=get_node)
+
+        self.assertEqual(original_payload, payload)
+        self.assertEqual(3, len(results))
+        for index, result in enumerate(results):
+            node_instance_id = 'node{0}'.format(index)
+            self.assertEqual({
+                'a': node_instance_id,
+                'b': '{0}_b'.format(node_instance_id),
+                'c': {'static': [1, {'key': 'value'}]},
+                'd': ['target', 'd'],
+            }, result)
+            self.assertEqual(1, calls[node_instance_id])
+        self.assertIsNot(results[0]['c'], results[1]['c'])
+        self.assertEqual(1, calls['target'])
+
+
+class TestRuntimeEvaluationStorage(TestCase):
+    def setUp(self):
+        super(TestRuntimeEvaluationStorage, self).setUp()
+        self.now = 0
+        self.calls = defaultdict(int)
+        self.node_instance = NodeInstance({
+            'id': 'node_1',
+            'node_id': 'node',
+            'runtime_properties': {'a': 'a_val'},
+        })
+
+    def _storage(self, **kwargs):
+        def get_node_instances(node_id):
+            self.calls['get_node_instances'] += 1
+            return [self.node_instance]
+
+        def get_node_instance(node_instance_id):
+            self.calls['get_node_instance'] += 1
+            return self.node_instance
+
+        def get_node(node_id):
+            self.calls['get_node'] += 1
+            return Node({'id': node_id})
+
+        return RuntimeEvaluationStorage(
+            get_node_instances,
+            get_node_instance,
+            get_node,
+            clock=lambda: self.now,
+            **kwargs)
+
+    def _evaluate(self, storage):
+        payload = {
+            'a': {'get_attribute': ['node', 'a']},
+            'b': {'get_attribute': ['SELF', 'a']},
+        }
+        return evaluate_functions(payload, {'self': 'node_1'}, storage=storage)
+
+    def test_shared_between_evaluations(self):
+        storage = self._storage()
+        for _ in range(3):
+            payload = self._evaluate(storage)
+            self.assertEqual({'a': 'a_val', 'b': 'a_val'}, payload)
+        outputs = evaluate_outputs(
+            {'a': {'value': {'get_attribute': ['node', 'a']}}},
+            storage=storage)
+        self.assertEqual({'a': 'a_val'}, outputs)
+        self.assertEqual(1, self.calls['get_node_instances'])
+        self.assertEqual(0, self.calls['get_node_instance'])
+
+    def test_ttl(self):
+        storage = self._storage(ttl=10)
+        storage.get_node('node')
+        self.now = 9
+        storage.get_node('node')
+        self.assertEqual(1, self.calls['get_node'])
+        self.now = 10
+        storage.get_node('node')
+        self.assertEqual(2, self.calls['get_node'])
+
+    def test_max_size(self):
+        storage = self._storage(max_size=2)
+        for node_id in ['a', 'b', 'a', 'c', 'a']:
+            storage.get_node(node_id)
+        self.assertEqual(3, self.calls['get_node'])
+        storage.get_node('b')
+        self.assertEqual(4, self.calls['get_node'])
+
+    def test_invalidate_node_instance(self):
+        storage = self._storage()
+        self._evaluate(storage)
+        self.node_instance = NodeInstance(
+            self.node_instance,
+            runtime_properties={'a': 'new_a_val'})
+        self.assertEqual({'a': 'a_val', 'b': 'a_val'}, self._evaluate(storage))
+        storage.invalidate_node_instance('node_1')
+        self.assertEqual(
+            {'a': 'new_a_val', 'b': 'new_a_val'}, self._evaluate(storage))
+        self.assertEqual(2, self.calls['get_node_instances'])
+
+    def test_invalidate_node(self):
+        storage = self._storage()
+        self._evaluate(storage)
+        storage.get_node('node')
+        storage.invalidate_node('node')
+        self._evaluate(storage)
+        storage.get_node('node')
+        self.assertEqual(2, self.calls['get_node_instances'])
+        self.assertEqual(2, self.calls['get_node'])
+
+    def test_clear(self):
+        storage = self._storage()
+        self._evaluate(storage)
+        storage.clear()
+        self._evaluate(storage)
+        self.assertEqual(2, self.calls['get_node_instances'])
+
+    def _scaling_group_storage(self, instances_num, **kwargs):
+        """
+        host instances, each in an instance of the scaling group g and
+        hosting an app and a db instance
+        """
+        self.node_instances = {}
+        for index in range(instances_num):
+            self.node_instances['host_{0}'.format(index)] = NodeInstance({
+                'id': 'host_{0}'.format(index),
+                'node_id': 'host',
+                'scaling_groups': [{'name': 'g', 'id': 'g_{0}'.format(index)}],
+            })
+            for node_id in ['app', 'db']:
+                node_instance_id = '{0}_{1}'.format(node_id, index)
+                self.node_instances[node_instance_id] = NodeInstance({
+                    'id': node_instance_id,
+                    'node_id': node_id,
+                    'relationships': [{'target_name': 'host',
+                                       'target_id': 'host_{0}'.format(index)}],
+                    'runtime_properties': {'key': index},
+                })
+        nodes = {'host': Node({'id': 'host'})}
+        for node_id in ['app', 'db']:
+            nodes[node_id] = Node({
+                'id': node_id,
+                'relationships': [{'target_id': 'host',
+                                   'type_hierarchy': [CONTAINED_IN_REL_TYPE]}],
+            })
+
+        def get_node_instances(node_id):
+            self.calls['get_node_instances'] += 1
+            return [i for i in self.node_instances.values()
+                    if i.node_id == node_id]
+
+        def get_node_instance(node_instance_id):
+            self.calls['get_node_instance'] += 1
+            return self.node_instances[node_instance_id]
+
+        def get_node(node_id):
+            self.calls['get_node'] += 1
+            return nodes[node_id]
+
+        return RuntimeEvaluationStorage(
+            get_node_instances,
+            get_node_instance,
+            get_node,
+            clock=lambda: self.now,
+            **kwargs)
+
+    def test_scaling_group_containment_index(self):
+        instances_num = 50
+        storage = self._scaling_group_storage(instances_num)
+        for index in range(instances_num):
+            payload = {'a': {'get_attribute': ['db', 'key']}}
+            evaluate_functions(
+                payload, {'self': 'app_{0}'.format(index)}, storage=storage)
+            self.assertEqual(index, payload['a'])
+        self.assertEqual(1, self.calls['get_node_instances'])
+        self.assertEqual(2 * instances_num, self.calls['get_node_instance'])
+        self.assertEqual(3, self.calls['get_node'])
+
+    def test_scaling_group_indexes_ttl(self):
+        storage = self._scaling_group_storage(2, ttl=10)
+
+        def evaluate():
+            return [
+                evaluate_functions(
+                    {'key': {'get_attribute': [node_name, 'key']}},
+                    {'self': self_instance_id},
+                    storage=storage)['key']
+                for self_instance_id, node_name in [('app_0', 'db'),
+                                                    ('db_0', 'SELF')]]
+        storage.get_node_instances('db')
+        self.now = 5
+        # the indexes are built from the db instances cached at 0
+        self.assertEqual([0, 0], evaluate())
+        self.node_instances['db_0'] = NodeInstance(
+            self.node_instances['db_0'], runtime_properties={'key': 'new'})
+        self.now = 9
+        self.assertEqual([0, 0], evaluate())
+        self.now = 10
+        self.assertEqual(['new', 'new'], evaluate())
+
 
 class NodeInstance(dict):
     @property
@@ -295,6 +295,39 @@ class TestRemovedContainedInMember(ParserTestCase):
         }
         self.assert_removal(groups, nodes, expected)
 
+    def test_removed_contained_in_member9(self):
+        groups = {
+            'group': ['node1', 'node2', 'node3', 'node4']
+        }
+        nodes = {
+            'node1': None,
+            'node2': 'node1',
+            'node3': None,
+            'node4': 'node3'
+        }
+        expected = {
+            'group': ['node1', 'node3']
+        }
+        self.assert_removal(groups, nodes, expected)
+
+    def test_removed_contained_in_member10(self):
+        # node4 and node5 are contained in members of the group, so the
+        # group is valid, however its node pairs are checked
+        groups = {
+            'group': ['node1', 'node2', 'node3', 'node4', 'node5']
+        }
+        nodes = {
+            'node1': None,
+            'node2': None,
+            'node3': None,
+            'node4': 'node3',
+            'node5': 'node1'
+        }
+        expected = {
+            'group': ['node1', 'node2', 'node3']
+        }
+        self.assert_removal(groups, nodes, expected)
+
     def assert_removal(self, groups, nodes, expected):
 
         self.template.from_members(
@@ -610,6 +643,40 @@ class TestScalingPoliciesAndGroupsValidation(ParserTestCase):
             groups=groups,
             nodes=nodes)
 
+    def test_validate_non_contained_group_members4(self):
+        groups = {
+            'group': ['node2', 'node3', 'node4']
+        }
+        nodes = {
+            'node1': None,
+            'node2': 'node1',
+            'node3': None,
+            'node4': 'node3'
+        }
+        self.assert_validation(
+            expected_error_code=ERROR_NON_CONTAINED_GROUP_MEMBERS,
+            groups=groups,
+            nodes=nodes)
+
+    def test_validate_non_contained_group_members5(self):
+        # group1 is fine, but the nodes of its group2 are contained in
+        # different nodes, which are not group2 members
+        groups = {
+            'group1': ['node1', 'node2', 'node3', 'group2'],
+            'group2': ['node4', 'node5']
+        }
+        nodes = {
+            'node1': None,
+            'node2': None,
+            'node3': None,
+            'node4': 'node3',
+            'node5': 'node1'
+        }
+        self.assert_validation(
+            expected_error_code=ERROR_NON_CONTAINED_GROUP_MEMBERS,
+            groups=groups,
+            nodes=nodes)
+
     def test_validate_illegal_instances_dict_value(self):
         nodes = {
             'node': None
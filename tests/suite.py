@@ -188,13 +188,14 @@ node_templates:
             ]
 
     @staticmethod
-    def modify_multi(plan, modified_nodes):
+    def modify_multi(plan, modified_nodes, **kwargs):
         return modify_deployment(
             nodes=plan['nodes'],
             previous_nodes=plan['nodes'],
             previous_node_instances=plan['node_instances'],
             modified_nodes=modified_nodes,
-            scaling_groups=plan['scaling_groups'])
+            scaling_groups=plan['scaling_groups'],
+            **kwargs)
 
     def assert_each_node_valid_hosted(self, nodes, hosts):
         node_ids, host_ids = self.node_ids(nodes), self.node_ids(hosts)